@@ -1,3 +1,5 @@
+import os
+
 S3_REGION_NAME = u"eu-central-1"
 
 S3_INPUT_BUCKET_NAME = u"flim-ai-sagemaker"
@@ -8,6 +10,19 @@ S3_OUPUT_RESCALED_NAME = u"midgar_divided_rescale"
 S3_OUPUT_DIVIDED_NAME = u"midgar_simple_rescale"
 S3_OUPUT_THUMBNAILED_NAME = u"midgar_thumbnail"
 
+# Where Datapoint reads the frames from, forced with MIDGAR_STORAGE (s3, local, archive or shards),
+# otherwise the first available backend of STORAGE_BACKENDS
+STORAGE_BACKEND = os.environ.get("MIDGAR_STORAGE", "")
+STORAGE_BACKENDS = ["shards", "archive", "local", "s3"]
+# Full mirror of S3_INPUT_BUCKET_NAME with the same layout
+LOCAL_MIRROR_PATH = os.environ.get("MIDGAR_LOCAL_MIRROR", "")
+# Uncompressed tar of the mirror, see storage.create_archive
+LOCAL_ARCHIVE_PATH = os.environ.get("MIDGAR_LOCAL_ARCHIVE", "")
+# Per movie shards written by data_loaders/repack.py, a directory or s3://<bucket>/<prefix>
+SHARDS_PATH = os.environ.get("MIDGAR_SHARDS", "")
+# Keys of the corrupt frames found by frame_validation, skipped by Datapoint and the exporters
+QUARANTINE_PATH = os.environ.get("MIDGAR_QUARANTINE", "data/quarantine.tsv")
+
 LOCAL_INPUT_CLASSES = u"data/dataset_movie.csv"
 
 LOCAL_INPUT_HEADER_ID = u"ID"
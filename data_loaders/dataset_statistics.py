@@ -0,0 +1,274 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+try:
+    from data_loaders import configs
+    from data_loaders.screenshot_loader import Datapoint
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+    from screenshot_loader import Datapoint
+except ModuleNotFoundError:
+    pass
+
+
+CACHE_VERSION = 1
+
+SPLITS = ["training", "validation", "testing", "unassigned"]
+
+
+class LabelArrays(object):
+    """Columns of the labels csv as numpy arrays.
+
+    Strings are dictionary encoded: `directors[director_codes]` gives back the
+    director of each row, same for titles. Rows of movies which are not in
+    configs.S3_INPUT_DIRECTORIES_NAMES have a year of 0.
+    """
+    __slots__ = ["ids", "director_codes", "title_codes", "classes",
+                 "timestamps", "years", "directors", "titles"]
+
+    FIELDS = ["ids", "director_codes", "title_codes", "classes",
+              "timestamps", "years", "directors", "titles"]
+
+    def __init__(self, **columns):
+        for field in self.FIELDS:
+            setattr(self, field, columns[field])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def uuids(self):
+        """Datapoint.uuid of every row.
+
+        The loader builds the uuid before knowing the year, the year part is
+        always None.
+        """
+        # One string per movie, then a single concatenation per row
+        movies, movie_codes = np.unique(self.movie_codes(), return_inverse=True)
+        movie_prefixes = ["{0}_None_{1}_".format(self.directors[movie // len(self.titles)],
+                                                 self.titles[movie % len(self.titles)])
+                          for movie in movies]
+        return [movie_prefixes[movie] + str(id)
+                for movie, id in zip(movie_codes.ravel().tolist(), self.ids.tolist())]
+
+
+    def movie_codes(self):
+        """One code per (director, title), two movies can share a title."""
+        return self.director_codes.astype(np.int64) * len(self.titles) + self.title_codes
+
+    def movie_names(self, codes):
+        """`<director> - <title>` of movie codes, the movie key of models/evaluation.py."""
+        return np.array(["{0} - {1}".format(self.directors[code // len(self.titles)],
+                                            self.titles[code % len(self.titles)])
+                         for code in codes])
+
+
+def load_label_arrays(class_path=configs.LOCAL_INPUT_CLASSES, cache_path=None):
+    """Parse the labels csv, or reuse its npz cache when the csv did not change."""
+    if cache_path is None:
+        cache_path = "{0}.npz".format(os.path.splitext(class_path)[0])
+    stat = os.stat(class_path)
+    signature = np.array([CACHE_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as cache:
+            if np.array_equal(cache["signature"], signature):
+                return LabelArrays(**{field: cache[field] for field in LabelArrays.FIELDS})
+
+    labels = _parse_labels(class_path)
+    np.savez(cache_path, signature=signature,
+             **{field: getattr(labels, field) for field in LabelArrays.FIELDS})
+    return labels
+
+
+def _parse_labels(class_path):
+    ids = []
+    directors = []
+    titles = []
+    classes = []
+    timestamps = []
+    skipped = 0
+    with open(class_path) as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=',')
+        header = next(csv_reader)
+        id_column = header.index(configs.LOCAL_INPUT_HEADER_ID)
+        director_column = header.index(configs.LOCAL_INPUT_HEADER_DIRECTOR)
+        title_column = header.index(configs.LOCAL_INPUT_HEADER_TITLE)
+        class_column = header.index(configs.LOCAL_INPUT_HEADER_CLASS)
+        timestamp_column = header.index(configs.LOCAL_INPUT_HEADER_TIMESTAMP)
+        for row in csv_reader:
+            try:
+                (hours, minutes, seconds) = row[timestamp_column].split(":")
+                timestamp = int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+                clas = int(float(row[class_column]))
+                id = int(row[id_column]) + 1
+            except ValueError:
+                # Broken rows, see doc/inbalance.md
+                skipped += 1
+                continue
+            ids.append(id)
+            directors.append(row[director_column])
+            titles.append(row[title_column])
+            classes.append(clas)
+            timestamps.append(timestamp)
+    if skipped > 0:
+        print("{0} malformed row(s) skipped".format(skipped))
+
+    director_values, director_codes = np.unique(np.array(directors), return_inverse=True)
+    title_values, title_codes = np.unique(np.array(titles), return_inverse=True)
+    director_codes = director_codes.ravel()
+    title_codes = title_codes.ravel()
+
+    # Year of each movie, from the directory it is stored in
+    directories_years = {directory[5:]: int(directory[:4])
+                         for directory in configs.S3_INPUT_DIRECTORIES_NAMES}
+    movies, movie_codes = np.unique(director_codes * len(title_values) + title_codes,
+                                    return_inverse=True)
+    movie_years = np.array([directories_years.get(
+        Datapoint(director=director_values[movie // len(title_values)],
+                  title=title_values[movie % len(title_values)]).build_key(), 0)
+        for movie in movies], dtype=np.int16)
+
+    return LabelArrays(ids=np.array(ids, dtype=np.int32),
+                       director_codes=director_codes.astype(np.int16),
+                       title_codes=title_codes.astype(np.int16),
+                       classes=_map_classes(np.array(classes, dtype=np.int64)),
+                       timestamps=np.array(timestamps, dtype=np.int32),
+                       years=movie_years[movie_codes.ravel()],
+                       directors=director_values,
+                       titles=title_values)
+
+
+def _map_classes(classes):
+    """Raw csv classes to Datapoint.CLASSES indexes, -1 for unknown classes."""
+    mapper = np.full(max(classes.max(initial=0), max(Datapoint.MAPPER)) + 1, -1, dtype=np.int8)
+    for clas, index in Datapoint.MAPPER.items():
+        mapper[clas] = index
+    return np.where(classes >= 0, mapper[np.maximum(classes, 0)], -1).astype(np.int8)
+
+
+def load_export_splits(path):
+    """uuid -> split of an export directory (<split>/<class>/<uuid>.<algorithm>.jpg)."""
+    splits = {}
+    for split in SPLITS:
+        split_path = os.path.join(path, split)
+        if not os.path.isdir(split_path):
+            continue
+        for clas in os.listdir(split_path):
+            for filename in os.listdir(os.path.join(split_path, clas)):
+                splits[filename.split(".")[0]] = split
+    return splits
+
+
+def split_codes(labels, splits):
+    codes = {split: index for index, split in enumerate(SPLITS)}
+    unassigned = codes["unassigned"]
+    return np.array([codes.get(splits.get(uuid), unassigned)
+                     for uuid in labels.uuids()], dtype=np.int8)
+
+
+def class_distribution(keys, classes, number_classes=len(Datapoint.CLASSES)):
+    """Number of rows of each class for each distinct key, as (keys, counts[key, class])."""
+    values, inverse = np.unique(keys, return_inverse=True)
+    valid = classes >= 0
+    counts = np.bincount(inverse.ravel()[valid] * number_classes + classes[valid],
+                         minlength=len(values) * number_classes)
+    return values, counts.reshape(len(values), number_classes)
+
+
+def compute_statistics(labels, splits=None):
+    """Class distributions overall and grouped by year, decade, director, movie and split."""
+    statistics = {
+        "classes": np.bincount(labels.classes[labels.classes >= 0],
+                               minlength=len(Datapoint.CLASSES))[np.newaxis, :],
+        "year": class_distribution(labels.years, labels.classes),
+        "decade": class_distribution(labels.years // 10 * 10, labels.classes),
+        "director": class_distribution(labels.director_codes, labels.classes),
+        "movie": class_distribution(labels.movie_codes(), labels.classes),
+    }
+    statistics["director"] = (labels.directors[statistics["director"][0]], statistics["director"][1])
+    statistics["movie"] = (labels.movie_names(statistics["movie"][0]), statistics["movie"][1])
+    statistics["classes"] = (np.array(["all"]), statistics["classes"])
+    if splits is not None:
+        values, counts = class_distribution(split_codes(labels, splits), labels.classes)
+        statistics["split"] = (np.array(SPLITS)[values], counts)
+    return statistics
+
+
+def imbalance_ratio(counts):
+    """Largest over smallest non empty class, per group."""
+    counts = counts.astype(np.float64)
+    smallest = np.where(counts > 0, counts, np.inf).min(axis=1)
+    return np.where(np.isfinite(smallest), counts.max(axis=1) / smallest, np.inf)
+
+
+def to_markdown(statistics):
+    lines = []
+    for group, (values, counts) in statistics.items():
+        lines.append("**Class distribution by {0}:**".format(group))
+        lines.append("")
+        lines.append("| {0} | {1} | total | imbalance |".format(group, " | ".join(Datapoint.CLASSES)))
+        lines.append("|" + "---|" * (len(Datapoint.CLASSES) + 3))
+        totals = counts.sum(axis=1)
+        ratios = imbalance_ratio(counts)
+        for value, row, total, ratio in zip(values, counts, totals, ratios):
+            cells = ["{0} ({1:.1%})".format(count, count / total if total > 0 else 0) for count in row]
+            lines.append("| {0} | {1} | {2} | {3:.2f} |".format(value, " | ".join(cells), total, ratio))
+        lines.append("")
+    return "\n".join(lines)
+
+
+MARKDOWN_BEGIN = "<!-- dataset_statistics begin -->"
+MARKDOWN_END = "<!-- dataset_statistics end -->"
+
+
+def update_markdown(path, statistics):
+    """Replace the generated section of the markdown document, append it the first time."""
+    section = "{0}\n{1}\n{2}".format(MARKDOWN_BEGIN, to_markdown(statistics), MARKDOWN_END)
+    content = ""
+    if os.path.isfile(path):
+        with open(path) as f:
+            content = f.read()
+    if MARKDOWN_BEGIN in content and MARKDOWN_END in content:
+        begin = content.index(MARKDOWN_BEGIN)
+        end = content.index(MARKDOWN_END) + len(MARKDOWN_END)
+        content = content[:begin] + section + content[end:]
+    else:
+        content = "{0}\n\n{1}\n".format(content.rstrip("\n"), section)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Class distribution of the dataset grouped by year, director, movie and split')
+    parser.add_argument('--classes',
+                        action="store",
+                        default=configs.LOCAL_INPUT_CLASSES,
+                        dest="classes",
+                        help="Labels csv")
+    parser.add_argument('--export',
+                        action="store",
+                        default="",
+                        dest="export",
+                        help="Export directory used to group by split")
+    parser.add_argument('--markdown',
+                        action="store",
+                        default="",
+                        dest="markdown",
+                        help="Markdown document to update, e.g. doc/inbalance.md")
+    args = parser.parse_args()
+
+    labels = load_label_arrays(args.classes)
+    splits = load_export_splits(args.export) if args.export != "" else None
+    statistics = compute_statistics(labels, splits=splits)
+    if args.markdown != "":
+        update_markdown(args.markdown, statistics)
+    else:
+        print(to_markdown(statistics))
@@ -11,18 +11,20 @@ from PIL import Image
 
 
 try:
+    from data_loaders.export_metrics import NullMetrics
     from data_loaders.screenshot_loader import Datapoint
 except ImportError:
     pass
 
 try:
     # Trying to find module on sys.path
+    from export_metrics import NullMetrics
     from screenshot_loader import Datapoint
 except ModuleNotFoundError:
     pass
 
 try:
-    from data_loaders import config
+    from data_loaders import configs
 except ImportError:
     pass
 
@@ -82,8 +84,10 @@ class DownSampler(object):
 
     def __init__(self,
                  path,
-                 split_strategy):
+                 split_strategy,
+                 metrics=None):
         self.split_strategy = split_strategy
+        self.metrics = metrics if metrics is not None else NullMetrics()
         self.datapoints_director = {}
         self.dataset_size = 0
 
@@ -98,44 +102,50 @@ class DownSampler(object):
                 self.dataset_size += 1
 
     def save(self):
-        random_name = str(uuid.uuid1())
-
-        training_size = round(self.dataset_size*0.8)
-        validation_size = round(self.dataset_size*0.1)
-        testing_size = (self.dataset_size - training_size) - training_size
-        if self.split_strategy == SplitStrategy.RANDOM:
-            datapoints = list(self.datapoints_director.values())
-            random.shuffle(datapoints)
-            training_set = datapoints[:training_size]
-            validation_set = datapoints[training_size:validation_size+training_size]
-            testing_set = datapoints[validation_size+training_size:]
-        elif self.split_strategy == SplitStrategy.DIRECTOR:
-            training_set = []
-            validation_set = []
-            testing_set = []
-            for director in self.datapoints_director:
-                if len(training_set) < training_size:
-                    training_set.extend(self.datapoints_director[director])
-                elif len(validation_set) < validation_size:
-                    validation_set.extend(self.datapoints_director[director])
-                else:
-                    testing_set.extend(self.datapoints_director[director])
-        else:
-            exit("Not supported split strategy")
         try:
-            os.mkdir("{0}_{1}".format(random_name,
-                                      self.split_strategy))
-        except FileExistsError:
-            pass
-
-        self._save_set(
-            training_set, "{0}_{1}/training".format(random_name,
+            random_name = str(uuid.uuid1())
+
+            training_size = round(self.dataset_size*0.8)
+            validation_size = round(self.dataset_size*0.1)
+            testing_size = (self.dataset_size - training_size) - training_size
+            if self.split_strategy == SplitStrategy.RANDOM:
+                datapoints = list(self.datapoints_director.values())
+                random.shuffle(datapoints)
+                training_set = datapoints[:training_size]
+                validation_set = datapoints[training_size:validation_size+training_size]
+                testing_set = datapoints[validation_size+training_size:]
+            elif self.split_strategy == SplitStrategy.DIRECTOR:
+                training_set = []
+                validation_set = []
+                testing_set = []
+                for director in self.datapoints_director:
+                    if len(training_set) < training_size:
+                        training_set.extend(self.datapoints_director[director])
+                    elif len(validation_set) < validation_size:
+                        validation_set.extend(self.datapoints_director[director])
+                    else:
+                        testing_set.extend(self.datapoints_director[director])
+            else:
+                exit("Not supported split strategy")
+            if self.metrics.enabled and self.metrics.total is None:
+                self.metrics.total = len(training_set) + len(validation_set) + len(testing_set)
+            try:
+                os.mkdir("{0}_{1}".format(random_name,
+                                          self.split_strategy))
+            except FileExistsError:
+                pass
+
+            self._save_set(
+                training_set, "{0}_{1}/training".format(random_name,
+                                                        self.split_strategy))
+            self._save_set(testing_set,
+                           "{0}_{1}/testing".format(random_name,
                                                     self.split_strategy))
-        self._save_set(testing_set,
-                       "{0}_{1}/testing".format(random_name,
-                                                self.split_strategy))
-        self._save_set(validation_set, "{0}_{1}/validation".format(random_name,
-                                                                   self.split_strategy))
+            self._save_set(validation_set, "{0}_{1}/validation".format(random_name,
+                                                                       self.split_strategy))
+            self.metrics.report(final=True)
+        finally:
+            self.metrics.close()
 
     def _save_set(self,
                   dataset,
@@ -146,10 +156,24 @@ class DownSampler(object):
             pass
 
         for datapoint in dataset:
-            datapoint.download_image()
-            datapoint.image.save("{0}/{1}.jpg".format(path,
-                                                      str(uuid.uuid1())))
+            try:
+                with self.metrics.stage("decode"):
+                    datapoint.download_image()
+                    datapoint.image.load()
+                if self.metrics.enabled:
+                    self.metrics.add_bytes("in", os.path.getsize(datapoint.path))
+                target = "{0}/{1}.jpg".format(path, str(uuid.uuid1()))
+                with self.metrics.stage("save"):
+                    datapoint.image.save(target)
+                if self.metrics.enabled:
+                    self.metrics.add_bytes("out", os.path.getsize(target))
+            except OSError as error:
+                print("OS ERROR - {0} - {1}".format(datapoint.path, error))
+                self.metrics.failure(type(error).__name__)
+                datapoint.purge()
+                continue
             datapoint.purge()
+            self.metrics.success()
 
 
 class SplitStrategy(enum.Enum):
@@ -0,0 +1,179 @@
+import bisect
+import itertools
+import json
+import sys
+import time
+from collections import Counter
+
+# Upper bounds in seconds of the latency histogram buckets, from 0.1 ms to 10 s.
+# Plain lists, numpy would double the startup time of the export commands
+LATENCY_BUCKETS = [10 ** (-4 + index / 4) for index in range(21)]
+
+
+class StageTimer(object):
+    __slots__ = ["metrics", "name", "start"]
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class ExportMetrics(object):
+    """Per stage latency histograms, byte and outcome counters of an export.
+
+    A json line with the progress, throughput and ETA is written every
+    `interval` seconds to `output` (a path or a file object, stderr by default).
+    close() closes the file opened for a path, the exporters call it at the
+    end of save().
+    """
+
+    enabled = True
+
+    def __init__(self, total=None, interval=10, output=None):
+        self.total = total
+        self.interval = interval
+        if output is None:
+            self.output = sys.stderr
+        elif isinstance(output, str):
+            self.output = open(output, "a")
+        else:
+            self.output = output
+        self.owns_output = isinstance(output, str)
+        self.histograms = {}
+        self.durations = Counter()
+        self.bytes = Counter()
+        self.successes = 0
+        self.failures = Counter()
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.last_processed = 0
+
+    def stage(self, name):
+        return StageTimer(self, name)
+
+    def close(self):
+        if self.owns_output:
+            self.output.close()
+
+    def observe(self, name, duration):
+        if name not in self.histograms:
+            self.histograms[name] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.histograms[name][bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.durations[name] += duration
+
+    def add_bytes(self, direction, count):
+        self.bytes[direction] += count
+
+    def success(self):
+        self.successes += 1
+        self._maybe_report()
+
+    def failure(self, error):
+        self.failures[error] += 1
+        self._maybe_report()
+
+    def processed(self):
+        return self.successes + sum(self.failures.values())
+
+    def _maybe_report(self):
+        if time.perf_counter() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self, final=False):
+        now = time.perf_counter()
+        processed = self.processed()
+        rate = (processed - self.last_processed) / max(now - self.last_report, 1e-9)
+        overall_rate = processed / max(now - self.start, 1e-9)
+        eta = None
+        if self.total is not None and overall_rate > 0:
+            eta = max(self.total - processed, 0) / overall_rate
+
+        stages = {}
+        for name, histogram in self.histograms.items():
+            count = sum(histogram)
+            stages[name] = {
+                "count": count,
+                "mean_ms": 1000 * self.durations[name] / count if count > 0 else None,
+                "p50_ms": self._percentile(histogram, 50),
+                "p95_ms": self._percentile(histogram, 95),
+                "histogram": list(histogram),
+            }
+
+        record = {
+            "time": time.time(),
+            "event": "export_done" if final else "export_progress",
+            "processed": processed,
+            "total": self.total,
+            "successes": self.successes,
+            "failures": dict(self.failures),
+            "images_per_second": rate,
+            "overall_images_per_second": overall_rate,
+            "eta_seconds": eta,
+            "bytes": dict(self.bytes),
+            "stages": stages,
+        }
+        self.output.write(json.dumps(record) + "\n")
+        self.output.flush()
+        self.last_report = now
+        self.last_processed = processed
+        return record
+
+    @staticmethod
+    def _percentile(histogram, percentile):
+        """Upper bound of the bucket holding the percentile, in milliseconds."""
+        count = sum(histogram)
+        if count == 0:
+            return None
+        index = bisect.bisect_left(list(itertools.accumulate(histogram)), count * percentile / 100)
+        if index >= len(LATENCY_BUCKETS):
+            return None
+        return 1000 * LATENCY_BUCKETS[index]
+
+
+class NullStageTimer(object):
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE_TIMER = NullStageTimer()
+
+
+class NullMetrics(object):
+    """Default metrics, every call is a no-op."""
+
+    enabled = False
+
+    def stage(self, name):
+        return NULL_STAGE_TIMER
+
+    def observe(self, name, duration):
+        pass
+
+    def add_bytes(self, direction, count):
+        pass
+
+    def success(self):
+        pass
+
+    def failure(self, error):
+        pass
+
+    def report(self, final=False):
+        return None
+
+    def close(self):
+        pass
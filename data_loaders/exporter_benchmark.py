@@ -0,0 +1,205 @@
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from PIL import Image
+
+try:
+    from data_loaders import configs
+    from data_loaders import screenshot_loader
+    from data_loaders.export_metrics import ExportMetrics
+    from data_loaders.local_s3 import LocalS3Resource, seed_bucket
+    from data_loaders.repack import repack
+    from data_loaders.storage import S3Storage, LocalStorage, ShardStorage, set_storage
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+    import screenshot_loader
+    from export_metrics import ExportMetrics
+    from local_s3 import LocalS3Resource, seed_bucket
+    from repack import repack
+    from storage import S3Storage, LocalStorage, ShardStorage, set_storage
+except ModuleNotFoundError:
+    pass
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StageRunner(object):
+    """Runs the export stages one after the other, every item timed by ExportMetrics.stage."""
+    __slots__ = ["metrics", "stages"]
+
+    def __init__(self):
+        # Never reported, only its histograms are read
+        self.metrics = ExportMetrics()
+        self.stages = []
+
+    def run(self, name, function, items):
+        """Apply function to every item, returns the results of the ones which succeeded."""
+        results = []
+        failures = 0
+        for item in items:
+            try:
+                with self.metrics.stage(name):
+                    results.append(function(item))
+            except OSError:
+                failures += 1
+        elapsed = self.metrics.durations[name]
+        self.stages.append({
+            "stage": name,
+            "items": len(results),
+            "failures": failures,
+            "seconds": elapsed,
+            "images_per_second": len(results) / elapsed if elapsed > 0 else None,
+            "peak_rss_mb": _peak_rss_mb(),
+        })
+        print("{0:<24} {1:>8} items {2:>10.1f} images/s".format(
+            name, len(results), self.stages[-1]["images_per_second"] or 0))
+        return results
+
+
+def run_benchmark(workdir, movies=4, frames_per_movie=250, templates=None, backend="s3"):
+    if templates is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        templates = sorted(glob.glob(os.path.join(root, "data", "test_augmentation", "*.jpg")))
+    if len(templates) == 0:
+        exit("Error - No template frame found")
+
+    directories = configs.S3_INPUT_DIRECTORIES_NAMES[:movies]
+    bucket_root = os.path.join(workdir, "s3")
+    class_path = os.path.join(workdir, "dataset_movie.csv")
+    seed_bucket(bucket_root, configs.S3_INPUT_BUCKET_NAME, directories,
+                frames_per_movie, templates, class_path)
+
+    # Every Datapoint now reads from the seeded directory, through the S3 code path, directly
+    # or from its shards
+    if backend == "s3":
+        storage = S3Storage(resource=LocalS3Resource(bucket_root))
+    elif backend == "shards":
+        repack(directories, os.path.join(workdir, "shards"),
+               storage=LocalStorage(os.path.join(bucket_root, configs.S3_INPUT_BUCKET_NAME)))
+        storage = ShardStorage(os.path.join(workdir, "shards"))
+    else:
+        storage = LocalStorage(os.path.join(bucket_root, configs.S3_INPUT_BUCKET_NAME))
+    set_storage(storage)
+    timer = StageRunner()
+
+    loader = screenshot_loader.ShotScaleLoader()
+    loader.obtain_datapoints(class_path=class_path)
+    datapoints = loader.datapoints
+
+    timer.run("list", lambda directory: list(storage.list(prefix=directory + "/")), directories)
+
+    def download(datapoint):
+        if not datapoint.download_image():
+            raise OSError("Download failed")
+        return datapoint
+    datapoints = timer.run("download", download, datapoints)
+
+    def decode(datapoint):
+        datapoint.image_path.seek(0)
+        image = Image.open(datapoint.image_path)
+        image.load()
+        return image
+    timer.run("decode", decode, datapoints)
+
+    exporter = None
+    for algorithm in [screenshot_loader.ResizeAlgorithm.CROPPED,
+                      screenshot_loader.ResizeAlgorithm.RESCALE]:
+        exporter = screenshot_loader.ShotScaleLocalExporter(path=os.path.join(workdir, "export") + "/",
+                                                            datapoints=datapoints,
+                                                            algorithm=algorithm)
+
+        def transform(datapoint):
+            datapoint.image_path.seek(0)
+            return exporter._transform_image(datapoint.image_path)
+        images = timer.run("transform_{0}".format(algorithm.name.lower()), transform, datapoints)
+
+    def encode(image):
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG")
+        return buffer.tell()
+    timer.run("encode", encode, images)
+
+    os.makedirs(exporter.path, exist_ok=True)
+
+    def save(pair):
+        (datapoint, image) = pair
+        datapoint.image = image
+        exporter._save(datapoint, target_path="/training")
+    timer.run("save", save, list(zip(datapoints, images)))
+    timer.run("compress", lambda _: exporter._compress(), [exporter])
+
+    return {
+        "date": datetime.now().isoformat(),
+        "revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "backend": backend,
+        "platform": platform.platform(),
+        "movies": movies,
+        "frames_per_movie": frames_per_movie,
+        "stages": timer.stages,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark every stage of ShotScaleExporter against a local S3 stand-in')
+    parser.add_argument('--movies',
+                        action="store",
+                        type=int,
+                        default=4,
+                        dest="movies",
+                        help="")
+    parser.add_argument('--frames',
+                        action="store",
+                        type=int,
+                        default=250,
+                        dest="frames",
+                        help="Frames per movie")
+    parser.add_argument('--backend',
+                        action="store",
+                        choices=["s3", "local", "shards"],
+                        default="s3",
+                        dest="backend",
+                        help="Read through the S3 backend on top of the stand-in, the filesystem backend or repacked shards")
+    parser.add_argument('--output',
+                        action="store",
+                        default="",
+                        dest="output",
+                        help="Json report, printed when not set")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report = run_benchmark(workdir, movies=args.movies, frames_per_movie=args.frames,
+                               backend=args.backend)
+
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,199 @@
+import argparse
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from data_loaders import configs
+    from data_loaders.storage import get_storage
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+    from storage import get_storage
+except ModuleNotFoundError:
+    pass
+
+
+HEAD_SIZE = 4096
+TAIL_SIZE = 64
+# Start of frame markers, C4 (DHT), C8 (JPG) and CC (DAC) are in the same range
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length, TEM and the restart markers
+STANDALONE_MARKERS = {0x01} | set(range(0xD0, 0xD8))
+# Even a black frame takes more than this, smaller objects were cut during the upload
+MIN_BYTES_PER_PIXEL = 0.002
+
+
+class Quarantine(object):
+    """Persistent list of the frames which can't be decoded, one `key<TAB>reason` per line."""
+
+    def __init__(self, path=configs.QUARANTINE_PATH):
+        self.path = path
+        self.keys = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    (key, _, reason) = line.rstrip("\n").partition("\t")
+                    if key != "":
+                        self.keys[key] = reason
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, prefix, bad_frames):
+        """Replace the entries under prefix by the (key, reason) found by the last check."""
+        self.keys = {key: reason for key, reason in self.keys.items() if not key.startswith(prefix)}
+        self.keys.update(bad_frames)
+
+    def save(self):
+        tmp_path = "{0}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            for key in sorted(self.keys):
+                f.write("{0}\t{1}\n".format(key, self.keys[key]))
+        os.replace(tmp_path, self.path)
+
+
+_quarantine = None
+
+
+def get_quarantine():
+    global _quarantine
+    if _quarantine is None:
+        _quarantine = Quarantine()
+    return _quarantine
+
+
+def set_quarantine(quarantine):
+    global _quarantine
+    _quarantine = quarantine
+
+
+def check_frame(storage, key, size):
+    """Why the object is not a complete jpeg, None when it looks fine.
+
+    Only the header and the last bytes are read, with ranged reads.
+    """
+    if size < 4:
+        return "empty object"
+    try:
+        head = storage.read_range(key, 0, min(HEAD_SIZE, size) - 1)
+        if head[:2] != b"\xff\xd8":
+            return "missing SOI marker"
+        tail = storage.read_range(key, max(size - TAIL_SIZE, 0), size - 1).rstrip(b"\x00")
+        if not tail.endswith(b"\xff\xd9"):
+            return "missing EOI marker"
+        dimensions = _read_dimensions(storage, key, size, head)
+    except OSError as error:
+        return "unreadable - {0}".format(error)
+
+    if dimensions is None:
+        return "missing frame header"
+    (width, height) = dimensions
+    if width == 0 or height == 0:
+        return "empty dimensions"
+    if size < width * height * MIN_BYTES_PER_PIXEL:
+        return "{0} bytes for {1}x{2}".format(size, width, height)
+    return None
+
+
+def frame_dimensions(storage, key):
+    """(width, height) of a stored jpeg read from its header, None without a frame header."""
+    head = storage.read_range(key, 0, HEAD_SIZE - 1)
+    if head[:2] != b"\xff\xd8":
+        return None
+    # A head shorter than asked is the whole frame
+    size = len(head) if len(head) < HEAD_SIZE else storage.size(key)
+    return _read_dimensions(storage, key, size, head)
+
+
+def _read_dimensions(storage, key, size, head):
+    """(width, height) of the start of frame segment, walking the segments from the SOI."""
+    offset = 2
+    while offset + 4 <= size:
+        if offset + 9 <= len(head):
+            segment = head[offset:offset + 9]
+        else:
+            # Large segment (exif thumbnail...), jump to the next one
+            segment = storage.read_range(key, offset, min(offset + 9, size) - 1)
+        if segment[0] != 0xFF:
+            return None
+        marker = segment[1]
+        if marker == 0xFF:
+            # Fill byte
+            offset += 1
+            continue
+        if marker in STANDALONE_MARKERS:
+            offset += 2
+            continue
+        if marker in SOF_MARKERS:
+            if len(segment) < 9:
+                return None
+            (height, width) = struct.unpack(">HH", segment[5:9])
+            return width, height
+        if marker in [0xD9, 0xDA]:
+            # End of image or scan data before any frame header
+            return None
+        (length, ) = struct.unpack(">H", segment[2:4])
+        if length < 2:
+            return None
+        offset += 2 + length
+    return None
+
+
+def check_prefix(storage, prefix):
+    """(key, reason) of the bad frames under prefix, and the number of frames checked."""
+    bad_frames = []
+    checked = 0
+    for key, size, _ in storage.list(prefix=prefix):
+        if not key.lower().endswith(".jpg"):
+            continue
+        reason = check_frame(storage, key, size)
+        if reason is not None:
+            bad_frames.append((key, reason))
+        checked += 1
+    return bad_frames, checked
+
+
+def validate_frames(prefixes, storage=None, quarantine=None, workers=16):
+    """Check every frame under the movie prefixes concurrently and update the quarantine."""
+    storage = storage if storage is not None else get_storage()
+    quarantine = quarantine if quarantine is not None else get_quarantine()
+
+    checked = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for prefix, (bad_frames, count) in zip(prefixes,
+                                               executor.map(lambda prefix: check_prefix(storage, prefix),
+                                                            prefixes)):
+            quarantine.update(prefix, bad_frames)
+            checked += count
+            for key, reason in bad_frames:
+                print("Quarantined {0} - {1}".format(key, reason))
+    quarantine.save()
+    print("{0} frame(s) checked, {1} in quarantine".format(checked, len(quarantine)))
+    return quarantine
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Find the truncated or corrupt frames without downloading them and quarantine them')
+    parser.add_argument('--movie',
+                        action="append",
+                        default=None,
+                        dest="movies",
+                        help="Directory of the movie to check, can be repeated, every movie by default")
+    parser.add_argument('--workers',
+                        action="store",
+                        type=int,
+                        default=16,
+                        dest="workers",
+                        help="Movies checked at the same time")
+    args = parser.parse_args()
+
+    directories = args.movies if args.movies is not None else configs.S3_INPUT_DIRECTORIES_NAMES
+    validate_frames(["{0}/".format(directory) for directory in directories], workers=args.workers)
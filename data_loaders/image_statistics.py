@@ -0,0 +1,246 @@
+import argparse
+import functools
+import json
+import os
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+
+try:
+    from data_loaders import configs
+    from data_loaders.frame_validation import frame_dimensions
+    from data_loaders.screenshot_loader import Datapoint, parse_exported_filename
+    from data_loaders.storage import get_storage
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+    from frame_validation import frame_dimensions
+    from screenshot_loader import Datapoint, parse_exported_filename
+    from storage import get_storage
+except ModuleNotFoundError:
+    pass
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Aspect ratio (width / height) histogram edges, from portrait to scope
+ASPECT_RATIO_BINS = np.linspace(0.5, 3.0, 26)
+
+LUMINANCE = np.array([0.299, 0.587, 0.114])
+
+
+class RunningMoments(object):
+    """Count, mean and sum of squared deviations, merged with Chan et al. parallel algorithm."""
+    __slots__ = ["count", "mean", "m2", "minimum", "maximum"]
+
+    def __init__(self, dimension=1):
+        self.count = 0
+        self.mean = np.zeros(dimension)
+        self.m2 = np.zeros(dimension)
+        self.minimum = np.full(dimension, np.inf)
+        self.maximum = np.full(dimension, -np.inf)
+
+    def add_samples(self, samples):
+        """Merge a (samples, dimension) array."""
+        samples = np.asarray(samples, dtype=np.float64).reshape(len(samples), -1)
+        if len(samples) == 0:
+            return
+        other = RunningMoments(samples.shape[1])
+        other.count = len(samples)
+        other.mean = samples.mean(axis=0)
+        other.m2 = ((samples - other.mean) ** 2).sum(axis=0)
+        other.minimum = samples.min(axis=0)
+        other.maximum = samples.max(axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = np.minimum(self.minimum, other.minimum)
+        self.maximum = np.maximum(self.maximum, other.maximum)
+
+    def variance(self):
+        return self.m2 / self.count if self.count > 0 else np.zeros_like(self.m2)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean.tolist(),
+            "std": np.sqrt(self.variance()).tolist(),
+            "min": self.minimum.tolist() if self.count > 0 else None,
+            "max": self.maximum.tolist() if self.count > 0 else None,
+        }
+
+
+class ImageStatistics(object):
+    """Channel moments and brightness of the exported images, resolutions and
+    aspect ratios of the input frames they were exported from (every exported
+    image has the output size)."""
+    __slots__ = ["pixels", "resolutions", "aspect_ratios", "brightness", "failures", "unresolved"]
+
+    def __init__(self):
+        # Channel values are scaled to [0, 1], like the training input
+        self.pixels = RunningMoments(3)
+        self.resolutions = Counter()
+        self.aspect_ratios = np.zeros(len(ASPECT_RATIO_BINS) + 1, dtype=np.int64)
+        self.brightness = {}
+        self.failures = 0
+        # Images without a source frame, left out of the resolutions and aspect ratios
+        self.unresolved = 0
+
+    def add_image(self, path, clas, source=None):
+        """`source` is the (width, height) of the input frame of the image, when known."""
+        with Image.open(path) as image:
+            pixels = np.asarray(image.convert("RGB"), dtype=np.float64).reshape(-1, 3) / 255.0
+        self.pixels.add_samples(pixels)
+        if source is None:
+            self.unresolved += 1
+        else:
+            (width, height) = source
+            self.resolutions["{0}x{1}".format(width, height)] += 1
+            self.aspect_ratios[np.searchsorted(ASPECT_RATIO_BINS, width / height)] += 1
+        if clas not in self.brightness:
+            self.brightness[clas] = RunningMoments(1)
+        self.brightness[clas].add_samples([[float((pixels @ LUMINANCE).mean())]])
+
+    def merge(self, other):
+        self.pixels.merge(other.pixels)
+        self.resolutions.update(other.resolutions)
+        self.aspect_ratios += other.aspect_ratios
+        for clas, moments in other.brightness.items():
+            if clas not in self.brightness:
+                self.brightness[clas] = RunningMoments(1)
+            self.brightness[clas].merge(moments)
+        self.failures += other.failures
+        self.unresolved += other.unresolved
+
+    def images(self):
+        return sum(moments.count for moments in self.brightness.values())
+
+    def to_dict(self):
+        return {
+            "images": self.images(),
+            "failures": self.failures,
+            "unresolved_sources": self.unresolved,
+            "channels": self.pixels.to_dict(),
+            "resolutions": dict(self.resolutions.most_common()),
+            "aspect_ratio_bins": ASPECT_RATIO_BINS.tolist(),
+            "aspect_ratios": self.aspect_ratios.tolist(),
+            "brightness": {clas: moments.to_dict() for clas, moments in sorted(self.brightness.items())},
+        }
+
+
+def source_dimensions(storage, directories, filename):
+    """(width, height) of the input frame an exported image comes from, None when it can't be found.
+
+    `directories` maps the key of a movie to its directory in the storage.
+    """
+    parsed = parse_exported_filename(filename)
+    if parsed is None:
+        return None
+    (director, title, id) = parsed
+    directory = directories.get(Datapoint(director=director, title=title).build_key())
+    if directory is None:
+        return None
+    try:
+        return frame_dimensions(storage, "{0}/{1}.jpg".format(directory, str(id).zfill(5)))
+    except OSError:
+        return None
+
+
+def _process_chunk(chunk, sources=True):
+    statistics = ImageStatistics()
+    if sources:
+        # Only the headers of the input frames are read, with ranged reads
+        storage = get_storage()
+        directories = {directory[5:]: directory for directory in configs.S3_INPUT_DIRECTORIES_NAMES}
+    for path, clas in chunk:
+        try:
+            source = source_dimensions(storage, directories, os.path.basename(path)) if sources else None
+            statistics.add_image(path, clas, source=source)
+        except OSError:
+            statistics.failures += 1
+    return statistics
+
+
+def list_images(path):
+    """(path, class) of every image of a split, one directory per class."""
+    images = []
+    for clas in sorted(os.listdir(path)):
+        if not os.path.isdir(os.path.join(path, clas)):
+            continue
+        for filename in sorted(os.listdir(os.path.join(path, clas))):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                images.append((os.path.join(path, clas, filename), clas))
+    return images
+
+
+def compute_image_statistics(path, processes=None, chunk_size=256, sources=True):
+    """Single read of every image of the split, spread over processes.
+
+    Without `sources` the input frames are not read and the resolutions and
+    aspect ratios stay empty.
+    """
+    images = list_images(path)
+    chunks = [images[start:start + chunk_size] for start in range(0, len(images), chunk_size)]
+    statistics = ImageStatistics()
+    with Pool(processes=processes) as pool:
+        for index, partial in enumerate(pool.imap_unordered(functools.partial(_process_chunk, sources=sources),
+                                                            chunks)):
+            statistics.merge(partial)
+            if index % 100 == 0:
+                print("{0}/{1} chunk(s) processed".format(index, len(chunks)))
+    return statistics
+
+
+def save_image_statistics(statistics, path):
+    with open(path, "w") as f:
+        json.dump(statistics.to_dict(), f, indent=2)
+
+
+def load_normalization(path):
+    """Per channel (mean, std) in [0, 1] saved by save_image_statistics."""
+    with open(path) as f:
+        channels = json.load(f)["channels"]
+    return np.array(channels["mean"], dtype=np.float32), np.array(channels["std"], dtype=np.float32)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Channel mean/std, resolutions, aspect ratios and brightness per class of an exported split')
+    parser.add_argument('--split',
+                        action="store",
+                        required=True,
+                        dest="split",
+                        help="Exported split, one directory per class")
+    parser.add_argument('--output',
+                        action="store",
+                        default="",
+                        dest="output",
+                        help="Json file, defaults to image_statistics.json in the split")
+    parser.add_argument('--processes',
+                        action="store",
+                        type=int,
+                        default=None,
+                        dest="processes",
+                        help="Defaults to the number of CPUs")
+    parser.add_argument('--no_sources',
+                        action="store_false",
+                        default=True,
+                        dest="sources",
+                        help="Don't read the headers of the input frames, no resolutions and aspect ratios")
+    args = parser.parse_args()
+
+    statistics = compute_image_statistics(args.split, processes=args.processes, sources=args.sources)
+    output = args.output if args.output != "" else os.path.join(args.split, "image_statistics.json")
+    save_image_statistics(statistics, output)
+    print("Statistics of {0} image(s) saved in {1}".format(statistics.images(), output))
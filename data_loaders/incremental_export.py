@@ -0,0 +1,196 @@
+import csv
+import os
+
+try:
+    from data_loaders import configs
+    from data_loaders.screenshot_loader import (ShotScaleLocalExporter, ResizeAlgorithm,
+                                                SplitStrategy, parse_exported_filename,
+                                                stable_split)
+    from data_loaders.storage import get_storage
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+    from screenshot_loader import (ShotScaleLocalExporter, ResizeAlgorithm,
+                                   SplitStrategy, parse_exported_filename,
+                                   stable_split)
+    from storage import get_storage
+except ModuleNotFoundError:
+    pass
+
+
+MANIFEST_NAME = "manifest.csv"
+
+MANIFEST_FIELDS = ["uuid", "key", "director", "class", "etag", "split", "algorithm"]
+
+
+def load_manifest(path):
+    """uuid -> row of the manifest of an export directory, empty for a new export."""
+    manifest = {}
+    if os.path.isfile(path):
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("director") is None:
+                    # Manifest written before the director column
+                    parsed = parse_exported_filename(row["uuid"])
+                    row["director"] = parsed[0] if parsed is not None else ""
+                manifest[row["uuid"]] = row
+    return manifest
+
+
+def save_manifest(path, manifest):
+    # Written aside then renamed, an interrupted export keeps the previous manifest
+    tmp_path = "{0}.tmp".format(path)
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS)
+        writer.writeheader()
+        for uuid in sorted(manifest):
+            writer.writerow(manifest[uuid])
+    os.replace(tmp_path, path)
+
+
+class ShotScaleIncrementalExporter(ShotScaleLocalExporter):
+    """Keeps one export directory up to date with the labels csv and the bucket.
+
+    The manifest of the directory records the class, source etag and split of
+    every exported datapoint. Only the datapoints which were added, relabeled
+    or whose frame changed since the previous export are saved again, the
+    ones which disappeared are deleted. A datapoint keeps the split of the
+    manifest. New ones get the split of stable_split of their uuid for the
+    random split. For the director split they get the split of their director
+    in the manifest, the new directors are assigned like
+    ShotScaleExporter.director_split does, from the largest to the smallest,
+    counting the datapoints the manifest already has in each split.
+
+    `movies` and `directors` are the titles and directors the datapoints were
+    filtered on. The manifest rows outside of them are kept as they are, only
+    the missing datapoints of the subset are deleted.
+    """
+
+    def __init__(self,
+                 path,
+                 datapoints,
+                 tmp=configs.DEFAULT_OUTPUT_NAME,
+                 algorithm=ResizeAlgorithm.UNKNOWN,
+                 split_strategy=SplitStrategy.RANDOM,
+                 metrics=None,
+                 movies=None,
+                 directors=None):
+        super().__init__(path, datapoints, tmp=tmp, algorithm=algorithm,
+                         split_strategy=split_strategy, metrics=metrics)
+        self.movies = set(movies) if movies is not None else None
+        self.directors = set(directors) if directors is not None else None
+        # Same directory on every run instead of a timestamped one
+        self.tmp = tmp
+        self.manifest_path = "{0}{1}/{2}".format(self.path, self.tmp, MANIFEST_NAME)
+        self.etags = {}
+        self.counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0, "failed": 0}
+
+    def save(self, streaming=False):
+        # The datapoints are read in one pass, streamed or not
+        try:
+            if self.split_strategy not in [SplitStrategy.RANDOM, SplitStrategy.DIRECTOR]:
+                exit("{0} Split strategy is not supported".format(self.split_strategy))
+            os.makedirs("{0}{1}".format(self.path, self.tmp), exist_ok=True)
+
+            previous = load_manifest(self.manifest_path)
+            manifest = {}
+            director_splits = {}
+            if self.split_strategy == SplitStrategy.DIRECTOR:
+                self.datapoints = list(self.datapoints)
+                director_splits = self._director_splits(previous)
+            for uuid in [uuid for uuid, row in previous.items() if not self._in_subset(row)]:
+                # Not streamed by this export, neither updated nor removed
+                manifest[uuid] = previous.pop(uuid)
+
+            for datapoint in self.datapoints:
+                key = datapoint._build_path()
+                etag = self._etag(key)
+                old = previous.pop(datapoint.uuid, None)
+                if etag is None:
+                    # Frame missing from the bucket, handled like a removed datapoint
+                    if old is not None:
+                        previous[datapoint.uuid] = old
+                    continue
+
+                if old is not None:
+                    split = old["split"]
+                elif self.split_strategy == SplitStrategy.DIRECTOR:
+                    split = director_splits[datapoint.director]
+                else:
+                    split = stable_split(datapoint.uuid)
+                row = {"uuid": datapoint.uuid, "key": key, "director": datapoint.director,
+                       "class": datapoint.obtain_classname(), "etag": etag, "split": split, "algorithm": str(self.algorithm)}
+
+                if old is not None and all(old[field] == row[field] for field in MANIFEST_FIELDS):
+                    manifest[datapoint.uuid] = old
+                    self.counts["unchanged"] += 1
+                    continue
+
+                if not self._export_datapoint(datapoint, target_path="/{0}".format(split)):
+                    self.counts["failed"] += 1
+                    if old is not None:
+                        # Retried on the next export
+                        manifest[datapoint.uuid] = old
+                    continue
+
+                if old is not None:
+                    if self._output_path(old) != self._output_path(row):
+                        self._remove(old)
+                    self.counts["changed"] += 1
+                else:
+                    self.counts["added"] += 1
+                manifest[datapoint.uuid] = row
+
+            for old in previous.values():
+                self._remove(old)
+                self.counts["removed"] += 1
+
+            save_manifest(self.manifest_path, manifest)
+            self.metrics.report(final=True)
+            print("Incremental export - {0}".format(
+                ", ".join("{0} {1}".format(count, name) for name, count in self.counts.items())))
+        finally:
+            self.metrics.close()
+
+    def _director_splits(self, manifest):
+        """director -> split, of the manifest and for the new directors of the datapoints."""
+        splits = {}
+        counts = {"training": 0, "validation": 0, "testing": 0}
+        for row in manifest.values():
+            splits.setdefault(row["director"], row["split"])
+            counts[row["split"]] += 1
+
+        sizes = {}
+        for datapoint in self.datapoints:
+            if datapoint.director not in splits:
+                sizes[datapoint.director] = sizes.get(datapoint.director, 0) + 1
+        for director, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            splits[director] = self.director_split(counts["training"], counts["validation"])
+            counts[splits[director]] += size
+        return splits
+
+    def _in_subset(self, row):
+        parsed = parse_exported_filename(row["uuid"])
+        title = parsed[1] if parsed is not None else None
+        return ((self.movies is None or title in self.movies) and
+                (self.directors is None or row["director"] in self.directors))
+
+    def _etag(self, key):
+        prefix = key.split("/")[0] + "/"
+        if prefix not in self.etags:
+            self.etags[prefix] = {listed_key: etag for listed_key, _, etag
+                                  in get_storage().list(prefix=prefix)}
+        return self.etags[prefix].get(key)
+
+    def _output_path(self, row):
+        return "{0}{1}/{2}/{3}/{4}.{5}.jpg".format(self.path, self.tmp, row["split"],
+                                                  row["class"], row["uuid"], row["algorithm"])
+
+    def _remove(self, row):
+        try:
+            os.remove(self._output_path(row))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,137 @@
+import csv
+import hashlib
+import io
+import os
+import random
+import shutil
+
+from botocore.errorfactory import ClientError
+from PIL import Image, ImageEnhance
+
+
+class LocalS3Resource(object):
+    """Filesystem stand-in for the subset of the boto3 S3 resource we use.
+
+    Each bucket is a directory of `root`, each object a file of the bucket.
+    """
+    __slots__ = ["root"]
+
+    def __init__(self, root):
+        self.root = root
+
+    def Bucket(self, name):
+        return LocalBucket(os.path.join(self.root, name))
+
+
+class LocalBucket(object):
+    __slots__ = ["path", "objects"]
+
+    def __init__(self, path):
+        self.path = path
+        self.objects = LocalObjects(path)
+
+    def Object(self, key):
+        return LocalObject(self.path, key)
+
+    def upload_file(self, Filename, Key):
+        path = os.path.join(self.path, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+
+class LocalObjects(object):
+    __slots__ = ["path"]
+
+    def __init__(self, path):
+        self.path = path
+
+    def filter(self, Prefix=""):
+        directory = os.path.join(self.path, os.path.dirname(Prefix))
+        if not os.path.isdir(directory):
+            return
+        for folder, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                key = os.path.relpath(os.path.join(folder, filename), self.path).replace(os.sep, "/")
+                if key.startswith(Prefix):
+                    yield LocalObjectSummary(self.path, key)
+
+    def all(self):
+        return self.filter()
+
+
+class LocalObjectSummary(object):
+    __slots__ = ["key", "size", "e_tag"]
+
+    def __init__(self, bucket_path, key):
+        stat = os.stat(os.path.join(bucket_path, key))
+        self.key = key
+        self.size = stat.st_size
+        # Not an md5 of the content, only stable while the file is not rewritten
+        self.e_tag = '"{0}"'.format(hashlib.md5("{0}-{1}".format(stat.st_size, stat.st_mtime_ns)
+                                                .encode("utf-8")).hexdigest())
+
+
+class LocalObject(object):
+    __slots__ = ["path", "key"]
+
+    def __init__(self, bucket_path, key):
+        self.path = os.path.join(bucket_path, key)
+        self.key = key
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+
+    def delete(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def download_fileobj(self, f):
+        self.load()
+        with open(self.path, "rb") as source:
+            shutil.copyfileobj(source, f)
+
+    def get(self, Range=None):
+        self.load()
+        with open(self.path, "rb") as source:
+            if Range is None:
+                data = source.read()
+            else:
+                (start, end) = Range[len("bytes="):].split("-")
+                source.seek(int(start))
+                data = source.read(int(end) - int(start) + 1)
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+
+def _directory_to_labels(directory):
+    (director, title) = directory[5:].split("_-_")
+    return director.replace("_", " "), title.replace("_", " ")
+
+
+def seed_bucket(root, bucket_name, directories, frames_per_movie, templates, class_path, seed=0):
+    """Write synthetic frames derived from the templates and the matching labels csv."""
+    random_state = random.Random(seed)
+    images = [Image.open(template).convert("RGB") for template in templates]
+    classes = ["0.0", "1.0", "2.0", "9.0"]
+
+    with open(class_path, "w", newline="") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["ID", "movie", "author", "Class", "movietime"])
+        for directory in directories:
+            (director, title) = _directory_to_labels(directory)
+            os.makedirs(os.path.join(root, bucket_name, directory), exist_ok=True)
+            for index in range(frames_per_movie):
+                image = images[random_state.randrange(len(images))]
+                # Slight random crop and brightness change, so that no two frames share their bytes
+                left = random_state.randrange(0, max(1, image.width // 10))
+                top = random_state.randrange(0, max(1, image.height // 10))
+                frame = image.crop((left, top, left + image.width * 9 // 10, top + image.height * 9 // 10))
+                frame = ImageEnhance.Brightness(frame).enhance(random_state.uniform(0.8, 1.2))
+                frame.save(os.path.join(root, bucket_name, directory,
+                                        "{0}.jpg".format(str(index + 1).zfill(5))),
+                           quality=random_state.randrange(75, 95))
+                csv_writer.writerow([index, title, director,
+                                     random_state.choice(classes),
+                                     "{0}:{1:02d}:{2:02d}".format(index // 3600,
+                                                                  index // 60 % 60,
+                                                                  index % 60)])
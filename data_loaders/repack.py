@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from data_loaders import configs
+    from data_loaders.frame_validation import get_quarantine
+    from data_loaders.storage import SHARD_INDEX_NAME, get_storage
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+    from frame_validation import get_quarantine
+    from storage import SHARD_INDEX_NAME, get_storage
+except ModuleNotFoundError:
+    pass
+
+
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+
+
+def repack_movie(storage, directory, output, shard_size=DEFAULT_SHARD_SIZE, quarantine=None):
+    """Pack the frames of a movie directory into shards of output/<directory>/.
+
+    The frames are appended in key order, so a movie is read back
+    sequentially. The shards of a run get names of their own, no file of the
+    previous offset table is ever rewritten. The offset table is then replaced
+    atomically and the shards it does not list are deleted: a reader sees
+    either the previous table and shards or the new ones.
+    """
+    quarantine = quarantine if quarantine is not None else get_quarantine()
+    movie_path = os.path.join(output, directory)
+    os.makedirs(movie_path, exist_ok=True)
+    run = uuid.uuid4().hex[:12]
+
+    shards = []
+    frames = {}
+    shard_file = None
+    written = 0
+    for key, _, etag in storage.list(prefix="{0}/".format(directory)):
+        if not key.lower().endswith(".jpg") or key in quarantine:
+            continue
+        try:
+            with storage.open(key) as f:
+                data = f.read()
+        except OSError:
+            print("Error while fetching ressource - {0}".format(key))
+            continue
+
+        if shard_file is None or (written > 0 and written + len(data) > shard_size):
+            if shard_file is not None:
+                shard_file.close()
+            shards.append("{0}.{1}.{2:05d}.shard".format(directory, run, len(shards)))
+            shard_file = open(os.path.join(movie_path, shards[-1]), "wb")
+            written = 0
+        shard_file.write(data)
+        frames[key] = [len(shards) - 1, written, len(data), etag]
+        written += len(data)
+    if shard_file is not None:
+        shard_file.close()
+
+    index_path = os.path.join(movie_path, SHARD_INDEX_NAME)
+    with open("{0}.tmp".format(index_path), "w") as f:
+        json.dump({"shards": shards, "frames": frames}, f)
+    os.replace("{0}.tmp".format(index_path), index_path)
+
+    # Shards of the previous runs, and of runs interrupted before their offset table
+    for filename in os.listdir(movie_path):
+        if filename.endswith(".shard") and filename not in shards:
+            os.remove(os.path.join(movie_path, filename))
+    return len(frames), sum(frame[2] for frame in frames.values())
+
+
+def upload_shards(output, destination, directories, resource=None):
+    """Copy the shards of the directories to s3://<bucket>/<prefix>, each offset table after its shards.
+
+    Once the new offset table is uploaded, the shards of the previous ones
+    are deleted from the bucket.
+    """
+    if resource is None:
+        import boto3
+        resource = boto3.resource('s3', region_name=configs.S3_REGION_NAME)
+    (bucket_name, _, prefix) = destination[len("s3://"):].partition("/")
+    prefix = prefix.strip("/") + "/" if prefix.strip("/") != "" else ""
+    bucket = resource.Bucket(bucket_name)
+    for directory in directories:
+        movie_path = os.path.join(output, directory)
+        if not os.path.isfile(os.path.join(movie_path, SHARD_INDEX_NAME)):
+            continue
+        with open(os.path.join(movie_path, SHARD_INDEX_NAME)) as f:
+            shards = json.load(f)["shards"]
+        for filename in shards + [SHARD_INDEX_NAME]:
+            bucket.upload_file(Filename=os.path.join(movie_path, filename),
+                               Key="{0}{1}/{2}".format(prefix, directory, filename))
+        for summary in list(bucket.objects.filter(Prefix="{0}{1}/".format(prefix, directory))):
+            if summary.key.endswith(".shard") and summary.key.split("/")[-1] not in shards:
+                bucket.Object(summary.key).delete()
+
+
+def repack(directories, output, storage=None, shard_size=DEFAULT_SHARD_SIZE, workers=8):
+    storage = storage if storage is not None else get_storage()
+    quarantine = get_quarantine()
+
+    frames = 0
+    total_size = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for directory, (count, size) in zip(directories,
+                                            executor.map(lambda directory: repack_movie(
+                                                storage, directory, output,
+                                                shard_size=shard_size, quarantine=quarantine),
+                                                directories)):
+            print("{0} - {1} frame(s), {2:.1f} MB".format(directory, count, size / 1024 / 1024))
+            frames += count
+            total_size += size
+    print("{0} frame(s) repacked, {1:.1f} MB".format(frames, total_size / 1024 / 1024))
+    return frames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Repack the frames of each movie into a few large indexed shards, read by the shards storage')
+    parser.add_argument('--output',
+                        action="store",
+                        required=True,
+                        dest="output",
+                        help="Local directory of the shards")
+    parser.add_argument('--upload',
+                        action="store",
+                        default="",
+                        dest="upload",
+                        help="Also copy the shards to s3://<bucket>/<prefix>")
+    parser.add_argument('--movie',
+                        action="append",
+                        default=None,
+                        dest="movies",
+                        help="Directory of the movie to repack, can be repeated, every movie by default")
+    parser.add_argument('--shard_size_mb',
+                        action="store",
+                        type=int,
+                        default=DEFAULT_SHARD_SIZE // 1024 // 1024,
+                        dest="shard_size_mb",
+                        help="")
+    parser.add_argument('--workers',
+                        action="store",
+                        type=int,
+                        default=8,
+                        dest="workers",
+                        help="Movies repacked at the same time")
+    args = parser.parse_args()
+
+    directories = args.movies if args.movies is not None else configs.S3_INPUT_DIRECTORIES_NAMES
+    repack(directories, args.output, shard_size=args.shard_size_mb * 1024 * 1024, workers=args.workers)
+    if args.upload != "":
+        upload_shards(args.output, args.upload, directories)
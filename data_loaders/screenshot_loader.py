@@ -1,36 +1,36 @@
-import boto3
-from botocore.errorfactory import ClientError
-
-import tempfile
 import argparse
 import csv
+import io
 import unidecode
 import sys
 import enum
 import random
+import zlib
 from datetime import datetime
 import os
 from zipfile import ZipFile
 import pathlib
 
-import tensorflow as tf
-
 from PIL import Image
 
 
 try:
-    from data_loaders import config
+    from data_loaders import configs
+    from data_loaders.export_metrics import NullMetrics
+    from data_loaders.frame_validation import get_quarantine
+    from data_loaders.storage import get_storage
 except ImportError:
     pass
 
 try:
     # Trying to find module on sys.path
     import configs
+    from export_metrics import NullMetrics
+    from frame_validation import get_quarantine
+    from storage import get_storage
 except ModuleNotFoundError:
     pass
 
-s3 = boto3.resource('s3', region_name=configs.S3_REGION_NAME)
-
 
 class Datapoint(object):
 
@@ -70,7 +70,6 @@ class Datapoint(object):
                  image_path=None):
         super().__init__()
         self.id = id
-        # self.s3_client = boto3.resource('s3')
         self.year = int(year) if year is not None else None
         self.director = director
         self.title = title
@@ -87,31 +86,23 @@ class Datapoint(object):
                 "Can't load image - There is at least one none value - ID : {0}, Year: {1}, Director: {2}, Title: {3}".format(self.id, self.year, self.director, self.title))
 
         path = self._build_path()
-
-        bucket = s3.Bucket(configs.S3_INPUT_BUCKET_NAME)
-
-        obj = bucket.Object(path)
-        tmp = tempfile.NamedTemporaryFile()
+        if self.is_quarantined():
+            return False
 
         try:
-            with open(tmp.name, 'wb') as f:
-                obj.download_fileobj(f)
-
-            self.image_path = tmp
-        except:
-            tmp.close()
+            self.image_path = get_storage().open(path)
+        except OSError:
             print("Error while fetching ressource - {0}".format(path))
             return False
 
         return True
 
     def is_valid_image_path(self):
-        try:
-            bucket = s3.Bucket(configs.S3_INPUT_BUCKET_NAME)
-            bucket.Object(self._build_path()).load()
-        except ClientError:
-            return False
-        return True
+        return not self.is_quarantined() and get_storage().exists(self._build_path())
+
+    def is_quarantined(self):
+        """Corrupt frame found by frame_validation, never downloaded."""
+        return self._build_path() in get_quarantine()
 
     def _build_path(self):
         path = u"{0}/{1}".format(
@@ -135,17 +126,16 @@ class Datapoint(object):
 
 
 class ShotScaleLoader(object):
-    __slot__ = ["s3_client",
-                "datapoints",
+    __slot__ = ["datapoints",
                 "classes_datapoints"]
 
     def __init__(self):
         super().__init__()
-        self.s3_client = boto3.resource('s3')
         self.datapoints = []
 
-    def obtain_datapoints(self):
-        self._load_classes_datapoints()
+    def obtain_datapoints(self,
+                          class_path=configs.LOCAL_INPUT_CLASSES):
+        self._load_classes_datapoints(class_path=class_path)
 
         movies_linked = 0
         for directory in self._load_directories():
@@ -162,6 +152,84 @@ class ShotScaleLoader(object):
         print("Total datapoints : {0}".format(
             len(self.datapoints)))
 
+    def iter_datapoints(self,
+                        class_path=configs.LOCAL_INPUT_CLASSES,
+                        movies=None,
+                        directors=None,
+                        classes=None,
+                        split=None,
+                        use_cache=False):
+        """Yield the datapoints of the known movies one at a time, in the csv order.
+
+        movies, directors and classes are collections of titles, directors and
+        class names to keep, split one of SPLITS as given by stable_split. With
+        use_cache the rows are read from the npz cache of dataset_statistics,
+        which drops the malformed rows and the unknown classes.
+        """
+        movies = set(movies) if movies is not None else None
+        directors = set(directors) if directors is not None else None
+        classes = set(classes) if classes is not None else None
+        if use_cache:
+            rows = self._iter_cached_rows(class_path, movies, directors, classes)
+        else:
+            rows = self._iter_csv_rows(class_path, movies, directors, classes)
+
+        for datapoint in rows:
+            if split is not None and stable_split(datapoint.uuid) != split:
+                continue
+            yield datapoint
+
+    def _iter_csv_rows(self, class_path, movies, directors, classes):
+        years = {directory[5:]: int(directory[:4]) for directory in self._load_directories()}
+        with open(class_path) as csv_file:
+            for row in csv.DictReader(csv_file, delimiter=','):
+                if movies is not None and row[configs.LOCAL_INPUT_HEADER_TITLE] not in movies:
+                    continue
+                if directors is not None and row[configs.LOCAL_INPUT_HEADER_DIRECTOR] not in directors:
+                    continue
+                datapoint = Datapoint(id=int(row[configs.LOCAL_INPUT_HEADER_ID])+1,
+                                      director=row[configs.LOCAL_INPUT_HEADER_DIRECTOR],
+                                      title=row[configs.LOCAL_INPUT_HEADER_TITLE],
+                                      timestamp=self._timestamp_to_second(
+                                          row[configs.LOCAL_INPUT_HEADER_TIMESTAMP]),
+                                      clas=row[configs.LOCAL_INPUT_HEADER_CLASS])
+                if classes is not None and (datapoint.clas not in Datapoint.MAPPER or
+                                            datapoint.obtain_classname() not in classes):
+                    continue
+                year = years.get(datapoint.build_key())
+                if year is None:
+                    continue
+                # Set after the uuid like obtain_datapoints, the uuid keeps a None year
+                datapoint.year = year
+                yield datapoint
+
+    def _iter_cached_rows(self, class_path, movies, directors, classes):
+        # dataset_statistics imports this module
+        try:
+            from data_loaders.dataset_statistics import load_label_arrays
+        except ImportError:
+            from dataset_statistics import load_label_arrays
+        import numpy as np
+
+        labels = load_label_arrays(class_path)
+        mask = (labels.years > 0) & (labels.classes >= 0)
+        if movies is not None:
+            mask &= np.isin(labels.titles, list(movies))[labels.title_codes]
+        if directors is not None:
+            mask &= np.isin(labels.directors, list(directors))[labels.director_codes]
+        if classes is not None:
+            mask &= np.isin(np.array(Datapoint.CLASSES), list(classes))[labels.classes]
+
+        raw_classes = {index: clas for clas, index in Datapoint.MAPPER.items()}
+        for row in np.flatnonzero(mask).tolist():
+            datapoint = Datapoint(id=int(labels.ids[row]),
+                                  director=str(labels.directors[labels.director_codes[row]]),
+                                  title=str(labels.titles[labels.title_codes[row]]),
+                                  timestamp=int(labels.timestamps[row]),
+                                  clas=raw_classes[int(labels.classes[row])])
+            datapoint.year = int(labels.years[row])
+            yield datapoint
+
     def obtain_valid_datapoints(self):
         if self.datapoints is None or len(self.datapoints) == 0:
             self.obtain_datapoints()
@@ -209,6 +277,37 @@ class ShotScaleLoader(object):
         return int(hours)*3600 + int(minutes)*60 + int(seconds)
 
 
+SPLITS = ["training", "validation", "testing"]
+
+
+def stable_split(uuid):
+    """Split of a datapoint which does not depend on the other datapoints.
+
+    Same proportions as the random split of ShotScaleExporter, one in ten
+    datapoints for testing and one in ten for validation.
+    """
+    bucket = zlib.crc32(uuid.encode("utf-8")) % 10
+    if bucket == 0:
+        return "testing"
+    elif bucket <= 8:
+        return "training"
+    return "validation"
+
+
+def parse_exported_filename(filename):
+    """(director, title, id) of a frame saved by ShotScaleLocalExporter, None for other names.
+
+    The exported name is `<director>_None_<title>_<id>.<algorithm>.jpg`, the
+    DownSampler names its frames with a uuid1 instead.
+    """
+    uuid = filename.partition(".ResizeAlgorithm")[0]
+    (director, separator, rest) = uuid.partition("_None_")
+    (title, _, id) = rest.rpartition("_")
+    if separator == "" or title == "" or not id.isdigit():
+        return None
+    return director, title, int(id)
+
+
 class ResizeAlgorithm(enum.Enum):
     UNKNOWN = 0
     CROPPED = 1
@@ -228,12 +327,15 @@ class ShotScaleExporter(object):
                  datapoints,
                  algorithm=ResizeAlgorithm.UNKNOWN,
                  split_strategy=SplitStrategy.RANDOM,
-                 sampling_size=(0.8, 0.1, 0.1)):
+                 sampling_size=(0.8, 0.1, 0.1),
+                 metrics=None):
         super().__init__()
         self.datapoints = datapoints
         self.algorithm = algorithm
         self.split_strategy = split_strategy
         self.sampling_size = sampling_size
+        # See data_loaders/export_metrics.py, ExportMetrics to enable the instrumentation
+        self.metrics = metrics if metrics is not None else NullMetrics()
         self.validation_set = []
         self.testing_set = []
         self.training_set = []
@@ -244,86 +346,110 @@ class ShotScaleExporter(object):
     def validating_size(self):
         return round(238024*self.sampling_size[1])
 
-    def save(self):
-        if self.split_strategy == SplitStrategy.NONE:
-            pass
-        elif self.split_strategy == SplitStrategy.RANDOM:
-            random.shuffle(self.datapoints)
-            index = 0
-            for datapoint in self.datapoints:
-                datapoint.download_image()
-                if datapoint.image_path is not None:
-                    try:
-                        datapoint.image = self._transform_image(
-                            datapoint.image_path)
-                        if index % 10 == 0:
-                            target_path = "/testing"
-                        elif index % 10 <= 8:
-                            target_path = "/training"
-                        else:
-                            target_path = "/validation"
-
-                        self._save(datapoint,
-                                   target_path=target_path)
+    def director_split(self, training_count, validation_count):
+        """Split of the next director of the director split, from the largest director to the smallest.
+
+        The training set is filled first, then the validation set, the
+        remaining directors go to testing.
+        """
+        if training_count < self.training_size():
+            return "training"
+        elif validation_count < self.validating_size():
+            return "validation"
+        return "testing"
+
+    def save(self, streaming=False):
+        """Export the datapoints into the split directories.
+
+        With streaming the datapoints are an iterator, as given by
+        ShotScaleLoader.iter_datapoints, saved as they come in constant memory.
+        """
+        try:
+            if streaming and self.split_strategy != SplitStrategy.RANDOM:
+                # Director sizes are needed before the first datapoint is saved
+                self.datapoints = list(self.datapoints)
+                streaming = False
+            if self.metrics.enabled and self.metrics.total is None and not streaming:
+                self.metrics.total = len(self.datapoints)
+
+            if self.split_strategy == SplitStrategy.NONE:
+                pass
+            elif streaming:
+                # stable_split does not depend on the other datapoints
+                for datapoint in self.datapoints:
+                    self._export_datapoint(datapoint,
+                                           target_path="/{0}".format(stable_split(datapoint.uuid)))
+            elif self.split_strategy == SplitStrategy.RANDOM:
+                random.shuffle(self.datapoints)
+                index = 0
+                for datapoint in self.datapoints:
+                    if index % 10 == 0:
+                        target_path = "/testing"
+                    elif index % 10 <= 8:
+                        target_path = "/training"
+                    else:
+                        target_path = "/validation"
+
+                    if self._export_datapoint(datapoint, target_path=target_path):
                         index += 1
-                    except OSError:
-                        print("OSError at save")
-
-        elif self.split_strategy == SplitStrategy.DIRECTOR:
-            directors = {}
-            for datapoint in self.datapoints:
-                if datapoint.director not in directors:
-                    directors[datapoint.director] = []
-                directors[datapoint.director].append(datapoint)
-
-            sorted_directors = [director for director, _ in
-                                sorted(
-                                    directors.items(),
-                                    key=lambda item: -len(item[1]))
-                                ]
-
-            for director in sorted_directors:
-                if len(self.training_set) < self.training_size():
-                    print(director, "Training")
+
+            elif self.split_strategy == SplitStrategy.DIRECTOR:
+                directors = {}
+                for datapoint in self.datapoints:
+                    if datapoint.director not in directors:
+                        directors[datapoint.director] = []
+                    directors[datapoint.director].append(datapoint)
+
+                sorted_directors = [director for director, _ in
+                                    sorted(
+                                        directors.items(),
+                                        key=lambda item: -len(item[1]))
+                                    ]
+
+                for director in sorted_directors:
+                    split = self.director_split(len(self.training_set), len(self.validation_set))
+                    print(director, split.capitalize())
                     for datapoint in directors[director]:
-                        try:
-                            datapoint.download_image()
-                            if datapoint.image_path is not None:
-                                datapoint.image = self._transform_image(
-                                    datapoint.image_path)
-                                self._save(datapoint,
-                                           target_path='/training')
+                        if self._export_datapoint(datapoint, target_path="/{0}".format(split)):
+                            if split == "training":
                                 self.training_set.append(datapoint)
-                        except OSError:
-                            print("OS ERROR - Bytes truncated")
-                elif len(self.validation_set) < self.validating_size():
-                    print(director, "Validation")
-                    for datapoint in directors[director]:
-                        try:
-                            datapoint.download_image()
-                            if datapoint.image_path is not None:
-                                datapoint.image = self._transform_image(
-                                    datapoint.image_path)
-                                self._save(datapoint,
-                                           target_path='/validation')
+                            elif split == "validation":
                                 self.validation_set.append(datapoint)
-                        except OSError:
-                            print("OS ERROR - Bytes truncated")
-                else:
-                    print(director, "Testing")
-                    for datapoint in directors[director]:
-                        try:
-                            datapoint.download_image()
-                            if datapoint.image_path is not None:
-                                datapoint.image = self._transform_image(
-                                    datapoint.image_path)
-                                self._save(datapoint,
-                                           target_path='/testing')
-                        except OSError:
-                            print("OS ERROR - Bytes truncated")
 
-        else:
-            exit("{0} Split strategy is not supported".format(self.split_strategy))
+            else:
+                exit("{0} Split strategy is not supported".format(self.split_strategy))
+
+            self.metrics.report(final=True)
+        finally:
+            self.metrics.close()
+
+    def _export_datapoint(self,
+                          datapoint,
+                          target_path=""):
+        """Download, resize and save one datapoint, returns False when it failed."""
+        if datapoint.is_quarantined():
+            self.metrics.failure("Quarantined")
+            return False
+        with self.metrics.stage("download"):
+            downloaded = datapoint.download_image()
+        if not downloaded:
+            self.metrics.failure("DownloadError")
+            return False
+        if self.metrics.enabled:
+            self.metrics.add_bytes("in", _stream_size(datapoint.image_path))
+
+        try:
+            datapoint.image = self._transform_image(datapoint.image_path)
+            self._save(datapoint,
+                       target_path=target_path)
+        except OSError as error:
+            print("OS ERROR - {0} - {1}".format(datapoint.uuid, error))
+            self.metrics.failure(type(error).__name__)
+            datapoint.purge()
+            return False
+
+        self.metrics.success()
+        return True
 
     def _save(self,
               datapoint,
@@ -335,8 +461,15 @@ class ShotScaleExporter(object):
 
     def _transform_image(self,
                          image_path):
-        image = Image.open(image_path)
+        with self.metrics.stage("decode"):
+            image = Image.open(image_path)
+            image.load()
+
+        with self.metrics.stage("resize"):
+            return self._resize_image(image)
 
+    def _resize_image(self,
+                      image):
         if self.algorithm == ResizeAlgorithm.CROPPED:
             lowest = min(image.width, image.height)
             ratio = lowest / configs.OUTPUT_IMAGE_SIZE
@@ -369,8 +502,10 @@ class ShotScaleLocalExporter(ShotScaleExporter):
                  datapoints,
                  tmp=configs.DEFAULT_OUTPUT_NAME,
                  algorithm=ResizeAlgorithm.UNKNOWN,
-                 split_strategy=SplitStrategy.RANDOM):
-        super().__init__(datapoints, algorithm=algorithm, split_strategy=split_strategy)
+                 split_strategy=SplitStrategy.RANDOM,
+                 metrics=None):
+        super().__init__(datapoints, algorithm=algorithm, split_strategy=split_strategy,
+                         metrics=metrics)
         self.path = path
         self.tmp = "{0}__{1}".format(
             tmp, datetime.now().strftime("%d-%m-%Y_%H:%M:%S"))
@@ -406,8 +541,13 @@ class ShotScaleLocalExporter(ShotScaleExporter):
             self.algorithm,
             "jpg")
         if datapoint.image is not None:
-            datapoint.image.save("{0}/{1}".format(path,
-                                                  filename))
+            with self.metrics.stage("encode"):
+                buffer = io.BytesIO()
+                datapoint.image.save(buffer, "JPEG")
+            with self.metrics.stage("save"):
+                with open("{0}/{1}".format(path, filename), "wb") as f:
+                    f.write(buffer.getbuffer())
+            self.metrics.add_bytes("out", buffer.tell())
             datapoint.purge()
 
 
@@ -423,7 +563,17 @@ class ShotScaleLocalExporter(ShotScaleExporter):
                     zipObj.write(filePath)
 
 
+def _stream_size(stream):
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+
 def load_from_remote(remote_path):
+    # Only this helper needs tensorflow, importing it takes seconds
+    import tensorflow as tf
+
     data_dir = tf.keras.utils.get_file(origin=remote_path,
                                        fname=remote_path.replace(".gz", ""),
                                        untar=True)
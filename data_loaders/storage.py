@@ -0,0 +1,380 @@
+import io
+import json
+import mmap
+import os
+import tarfile
+import threading
+
+try:
+    from data_loaders import configs
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    import configs
+except ModuleNotFoundError:
+    pass
+
+
+class StorageBackend(object):
+    """Read access to the input frames, keys are `<year>_<director>_-_<title>/<id>.jpg`."""
+
+    name = "unknown"
+
+    def open(self, key):
+        """Readable binary file object of the key, raises OSError when it can't be read."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def read_range(self, key, start, end):
+        """Bytes [start, end] of the key, both included like an HTTP range."""
+        with self.open(key) as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def list(self, prefix=""):
+        """(key, size, etag) of every object under prefix."""
+        raise NotImplementedError
+
+    def scan(self, prefix=""):
+        """(key, bytes) of every object under prefix, in the order they are stored."""
+        for key, _, _ in self.list(prefix=prefix):
+            with self.open(key) as f:
+                yield key, f.read()
+
+
+class S3Storage(StorageBackend):
+    name = "s3"
+
+    def __init__(self,
+                 bucket_name=configs.S3_INPUT_BUCKET_NAME,
+                 region_name=configs.S3_REGION_NAME,
+                 resource=None):
+        self.bucket_name = bucket_name
+        self.region_name = region_name
+        self.resource = resource
+        self.local = threading.local()
+
+    def _bucket(self):
+        # boto3 is only imported and connected when the first frame is read,
+        # boto3 resources are not thread safe so every thread gets its own
+        bucket = getattr(self.local, "bucket", None)
+        if bucket is None:
+            resource = self.resource
+            if resource is None:
+                import boto3
+                resource = boto3.session.Session().resource('s3', region_name=self.region_name)
+            bucket = self.local.bucket = resource.Bucket(self.bucket_name)
+        return bucket
+
+    def open(self, key):
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            return io.BytesIO(self._bucket().Object(key).get()["Body"].read())
+        except (BotoCoreError, ClientError) as error:
+            raise OSError("Can't fetch {0} - {1}".format(key, error))
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self._bucket().Object(key).load()
+        except ClientError:
+            return False
+        return True
+
+    def size(self, key):
+        return self._bucket().Object(key).content_length
+
+    def read_range(self, key, start, end):
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            response = self._bucket().Object(key).get(Range="bytes={0}-{1}".format(start, end))
+        except (BotoCoreError, ClientError) as error:
+            raise OSError("Can't fetch {0} - {1}".format(key, error))
+        return response["Body"].read()
+
+    def list(self, prefix=""):
+        for summary in self._bucket().objects.filter(Prefix=prefix):
+            yield summary.key, summary.size, summary.e_tag.strip('"')
+
+
+class LocalStorage(StorageBackend):
+    """Local mirror of the bucket, same layout as the bucket."""
+    name = "local"
+
+    def __init__(self, root=configs.LOCAL_MIRROR_PATH):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def list(self, prefix=""):
+        directory = os.path.join(self.root, os.path.dirname(prefix))
+        if not os.path.isdir(directory):
+            return
+        for folder, _, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                path = os.path.join(folder, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    yield key, stat.st_size, "{0:x}-{1:x}".format(stat.st_size, stat.st_mtime_ns)
+
+
+class ArchiveStorage(StorageBackend):
+    """Frames packed in one uncompressed tar file, read through a memory map.
+
+    The offsets of the members are indexed once and saved next to the archive
+    (<archive>.index.json), reading a frame is then a slice of the map.
+    """
+    name = "archive"
+
+    def __init__(self, path=configs.LOCAL_ARCHIVE_PATH):
+        self.path = path
+        self.index = None
+        self.file = None
+        self.map = None
+
+    def _load(self):
+        if self.map is None:
+            self.index = self._load_index()
+            self.file = open(self.path, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def _load_index(self):
+        index_path = "{0}.index.json".format(self.path)
+        if os.path.isfile(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(self.path):
+            with open(index_path) as f:
+                return json.load(f)
+        index = {}
+        with tarfile.open(self.path, "r:") as archive:
+            for member in archive:
+                if member.isfile():
+                    index[member.name] = [member.offset_data, member.size]
+        with open(index_path, "w") as f:
+            json.dump(index, f)
+        return index
+
+    def _entry(self, key):
+        self._load()
+        if key not in self.index:
+            raise OSError("{0} is not in {1}".format(key, self.path))
+        return self.index[key]
+
+    def open(self, key):
+        (offset, size) = self._entry(key)
+        return io.BytesIO(self.map[offset:offset + size])
+
+    def exists(self, key):
+        self._load()
+        return key in self.index
+
+    def size(self, key):
+        return self._entry(key)[1]
+
+    def read_range(self, key, start, end):
+        (offset, size) = self._entry(key)
+        return self.map[offset + start:offset + min(end + 1, size)]
+
+    def list(self, prefix=""):
+        self._load()
+        for key in sorted(self.index):
+            if key.startswith(prefix):
+                (offset, size) = self.index[key]
+                yield key, size, "{0:x}-{1:x}".format(offset, size)
+
+
+SHARD_INDEX_NAME = "index.json"
+
+
+class ShardStorage(StorageBackend):
+    """Frames of each movie packed in a few large shards, see data_loaders/repack.py.
+
+    `<movie>/index.json` holds the offset table, the shard, offset, size and
+    source etag of every frame. Local shards are read through memory maps,
+    shards in a bucket with ranged reads of READ_AHEAD bytes, so that reading
+    the frames of a movie in order only takes a few requests.
+
+    The movies without an offset table, not repacked yet, are read from
+    `fallback`, the first other available backend by default.
+    """
+    name = "shards"
+
+    READ_AHEAD = 8 * 1024 * 1024
+
+    def __init__(self, path=configs.SHARDS_PATH, resource=None, fallback=None):
+        self.path = path
+        if path.startswith("s3://"):
+            (bucket_name, _, prefix) = path[len("s3://"):].partition("/")
+            self.files = S3Storage(bucket_name=bucket_name, resource=resource)
+            self.prefix = prefix.strip("/") + "/" if prefix.strip("/") != "" else ""
+        else:
+            self.files = None
+            self.prefix = None
+        self.fallback = fallback
+        self.indexes = {}
+        self.maps = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _index(self, movie):
+        """Offset table of the movie, None when it was not repacked."""
+        if movie not in self.indexes:
+            try:
+                if self.files is None:
+                    with open(os.path.join(self.path, movie, SHARD_INDEX_NAME)) as f:
+                        index = json.load(f)
+                else:
+                    with self.files.open("{0}{1}/{2}".format(self.prefix, movie, SHARD_INDEX_NAME)) as f:
+                        index = json.load(f)
+            except OSError:
+                index = None
+            self.indexes[movie] = index
+        return self.indexes[movie]
+
+    def _source(self, key):
+        """Fallback backend when the movie of the key was not repacked, None otherwise."""
+        if self._index(key.split("/")[0]) is not None:
+            return None
+        if self.fallback is None:
+            self.fallback = _pick_storage(exclude=[self.name])
+        return self.fallback
+
+    def _entry(self, key):
+        movie = key.split("/")[0]
+        index = self._index(movie)
+        if key not in index["frames"]:
+            raise OSError("{0} is not in the shards of {1}".format(key, self.path))
+        (shard, offset, size, _) = index["frames"][key]
+        return movie, index["shards"][shard], offset, size
+
+    def _read(self, movie, shard, offset, size):
+        if self.files is None:
+            with self.lock:
+                if shard not in self.maps:
+                    with open(os.path.join(self.path, movie, shard), "rb") as f:
+                        self.maps[shard] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.maps[shard][offset:offset + size]
+
+        # The window read last by this thread, usually holds the next frames of the movie
+        window = getattr(self.local, "window", None)
+        if window is None or window[0] != shard or offset < window[1] or \
+                offset + size > window[1] + len(window[2]):
+            data = self.files.read_range("{0}{1}/{2}".format(self.prefix, movie, shard),
+                                         offset, offset + max(size, self.READ_AHEAD) - 1)
+            window = self.local.window = (shard, offset, data)
+        return window[2][offset - window[1]:offset - window[1] + size]
+
+    def open(self, key):
+        source = self._source(key)
+        if source is not None:
+            return source.open(key)
+        return io.BytesIO(self._read(*self._entry(key)))
+
+    def exists(self, key):
+        source = self._source(key)
+        if source is not None:
+            return source.exists(key)
+        return key in self._index(key.split("/")[0])["frames"]
+
+    def size(self, key):
+        source = self._source(key)
+        if source is not None:
+            return source.size(key)
+        return self._entry(key)[3]
+
+    def read_range(self, key, start, end):
+        source = self._source(key)
+        if source is not None:
+            return source.read_range(key, start, end)
+        (movie, shard, offset, size) = self._entry(key)
+        return self._read(movie, shard, offset + start, min(end + 1, size) - start)
+
+    def list(self, prefix=""):
+        if "/" in prefix:
+            movies = [prefix.split("/")[0]]
+        else:
+            movies = [directory for directory in configs.S3_INPUT_DIRECTORIES_NAMES
+                      if directory.startswith(prefix)]
+        for movie in movies:
+            source = self._source("{0}/".format(movie))
+            if source is not None:
+                yield from source.list(prefix=prefix if "/" in prefix else "{0}/".format(movie))
+                continue
+            frames = self._index(movie)["frames"]
+            # Shard then offset order, the order of a sequential read
+            for key in sorted(frames, key=lambda key: frames[key][:2]):
+                if key.startswith(prefix):
+                    yield key, frames[key][2], frames[key][3]
+
+
+def create_archive(root, path):
+    """Pack a local mirror into an archive readable by ArchiveStorage."""
+    with tarfile.open(path, "w:") as archive:
+        for folder, _, filenames in os.walk(root):
+            for filename in sorted(filenames):
+                file_path = os.path.join(folder, filename)
+                archive.add(file_path, arcname=os.path.relpath(file_path, root).replace(os.sep, "/"))
+
+
+BACKENDS = {
+    "shards": lambda: ShardStorage(),
+    "archive": lambda: ArchiveStorage(),
+    "local": lambda: LocalStorage(),
+    "s3": lambda: S3Storage(),
+}
+
+
+def _available(name):
+    if name == "shards":
+        return configs.SHARDS_PATH != "" and (configs.SHARDS_PATH.startswith("s3://") or
+                                               os.path.isdir(configs.SHARDS_PATH))
+    if name == "archive":
+        return configs.LOCAL_ARCHIVE_PATH != "" and os.path.isfile(configs.LOCAL_ARCHIVE_PATH)
+    if name == "local":
+        return configs.LOCAL_MIRROR_PATH != "" and os.path.isdir(configs.LOCAL_MIRROR_PATH)
+    return True
+
+
+_storage = None
+
+
+def get_storage():
+    """Configured backend, or the fastest one available in configs.STORAGE_BACKENDS order."""
+    global _storage
+    if _storage is None:
+        if configs.STORAGE_BACKEND != "":
+            if configs.STORAGE_BACKEND not in BACKENDS:
+                exit("Error - Unknown storage backend {0}".format(configs.STORAGE_BACKEND))
+            _storage = BACKENDS[configs.STORAGE_BACKEND]()
+        else:
+            _storage = _pick_storage()
+        print("Reading frames from the {0} storage".format(_storage.name))
+    return _storage
+
+
+def _pick_storage(exclude=()):
+    for name in configs.STORAGE_BACKENDS:
+        if name not in exclude and _available(name):
+            return BACKENDS[name]()
+
+
+def set_storage(storage):
+    global _storage
+    _storage = storage
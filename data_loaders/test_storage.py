@@ -0,0 +1,152 @@
+import os
+
+import pytest
+
+from data_loaders import repack
+from data_loaders.frame_validation import Quarantine
+from data_loaders.local_s3 import LocalS3Resource
+from data_loaders.storage import (SHARD_INDEX_NAME, ArchiveStorage, LocalStorage, S3Storage,
+                                  ShardStorage, create_archive)
+
+# Directories of configs.S3_INPUT_DIRECTORIES_NAMES, the shards storage lists those
+REPACKED = "1949_Bergman_-_Fangelse"
+NOT_REPACKED = "1950_Fellini_-_Luci_del_varieta"
+
+FRAMES = {
+    "{0}/00001.jpg".format(REPACKED): b"\xff\xd8first frame\xff\xd9",
+    "{0}/00002.jpg".format(REPACKED): b"\xff\xd8second frame, a bit longer\xff\xd9",
+    "{0}/00003.jpg".format(REPACKED): b"\xff\xd8third frame\xff\xd9",
+    "{0}/00001.jpg".format(NOT_REPACKED): b"\xff\xd8other movie\xff\xd9",
+}
+
+
+def _write_mirror(root):
+    for key, data in FRAMES.items():
+        path = os.path.join(root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def _repack(mirror, output):
+    # Small shards, the frames of the movie span several of them
+    repack.repack_movie(LocalStorage(root=mirror), REPACKED, output, shard_size=40,
+                        quarantine=Quarantine(path=os.path.join(output, "quarantine.tsv")))
+
+
+@pytest.fixture(params=["local", "archive", "s3", "shards", "s3_shards"])
+def storage(request, tmp_path):
+    """Every backend over the same frames, without any network access."""
+    mirror = str(tmp_path / "mirror")
+    if request.param == "s3":
+        _write_mirror(str(tmp_path / "s3" / "bucket"))
+        return S3Storage(bucket_name="bucket", resource=LocalS3Resource(str(tmp_path / "s3")))
+    _write_mirror(mirror)
+    if request.param == "local":
+        return LocalStorage(root=mirror)
+    if request.param == "archive":
+        create_archive(mirror, str(tmp_path / "frames.tar"))
+        return ArchiveStorage(path=str(tmp_path / "frames.tar"))
+
+    # Only one movie is repacked, the other one is read from the fallback
+    _repack(mirror, str(tmp_path / "shards"))
+    if request.param == "shards":
+        return ShardStorage(path=str(tmp_path / "shards"), fallback=LocalStorage(root=mirror))
+    resource = LocalS3Resource(str(tmp_path / "s3"))
+    os.makedirs(str(tmp_path / "s3" / "bucket"))
+    repack.upload_shards(str(tmp_path / "shards"), "s3://bucket/shards", [REPACKED], resource=resource)
+    return ShardStorage(path="s3://bucket/shards", resource=resource, fallback=LocalStorage(root=mirror))
+
+
+def test_open(storage):
+    for key, data in FRAMES.items():
+        with storage.open(key) as f:
+            assert f.read() == data
+
+
+def test_open_missing_key(storage):
+    with pytest.raises(OSError):
+        storage.open("{0}/00004.jpg".format(REPACKED))
+    with pytest.raises(OSError):
+        storage.open("{0}/00004.jpg".format(NOT_REPACKED))
+
+
+def test_exists(storage):
+    assert storage.exists("{0}/00001.jpg".format(REPACKED))
+    assert storage.exists("{0}/00001.jpg".format(NOT_REPACKED))
+    assert not storage.exists("{0}/00004.jpg".format(REPACKED))
+    assert not storage.exists(REPACKED)
+
+
+def test_read_range(storage):
+    key = "{0}/00002.jpg".format(REPACKED)
+    assert storage.read_range(key, 0, 1) == b"\xff\xd8"
+    assert storage.read_range(key, 2, 7) == FRAMES[key][2:8]
+    assert storage.read_range(key, len(FRAMES[key]) - 2, len(FRAMES[key]) - 1) == b"\xff\xd9"
+    # The end is clamped to the size, like an HTTP range
+    assert storage.read_range(key, 0, 4095) == FRAMES[key]
+    key = "{0}/00001.jpg".format(NOT_REPACKED)
+    assert storage.read_range(key, 2, 7) == FRAMES[key][2:8]
+
+
+def test_list(storage):
+    listed = list(storage.list(prefix="{0}/".format(REPACKED)))
+    assert [key for key, _, _ in listed] == sorted(key for key in FRAMES if key.startswith(REPACKED))
+    assert [size for _, size, _ in listed] == [len(FRAMES[key]) for key, _, _ in listed]
+    assert all(etag != "" for _, _, etag in listed)
+    assert sorted(key for key, _, _ in storage.list()) == sorted(FRAMES)
+    assert [key for key, _, _ in storage.list(prefix="{0}/".format(NOT_REPACKED))] == \
+        ["{0}/00001.jpg".format(NOT_REPACKED)]
+    assert list(storage.list(prefix="1999_Nobody_-_Nothing/")) == []
+
+
+def test_repack_replaces_the_shards(tmp_path):
+    mirror = str(tmp_path / "mirror")
+    output = str(tmp_path / "shards")
+    _write_mirror(mirror)
+    _repack(mirror, output)
+    movie_path = os.path.join(output, REPACKED)
+    first_shards = sorted(filename for filename in os.listdir(movie_path) if filename.endswith(".shard"))
+    assert len(first_shards) > 1
+
+    key = "{0}/00002.jpg".format(REPACKED)
+    with open(os.path.join(mirror, key), "wb") as f:
+        f.write(b"\xff\xd8relabeled\xff\xd9")
+    _repack(mirror, output)
+
+    shards = sorted(filename for filename in os.listdir(movie_path) if filename.endswith(".shard"))
+    assert set(shards).isdisjoint(first_shards)
+    storage = ShardStorage(path=output, fallback=LocalStorage(root=mirror))
+    assert sorted(storage._index(REPACKED)["shards"]) == shards
+    with storage.open(key) as f:
+        assert f.read() == b"\xff\xd8relabeled\xff\xd9"
+
+
+def test_interrupted_repack_keeps_the_previous_table(tmp_path, monkeypatch):
+    mirror = str(tmp_path / "mirror")
+    output = str(tmp_path / "shards")
+    _write_mirror(mirror)
+    _repack(mirror, output)
+    with open(os.path.join(output, REPACKED, SHARD_INDEX_NAME)) as f:
+        index = f.read()
+
+    key = "{0}/00002.jpg".format(REPACKED)
+    with open(os.path.join(mirror, key), "wb") as f:
+        f.write(b"\xff\xd8relabeled\xff\xd9")
+
+    def crash(source, destination):
+        raise OSError("crash before the offset table is replaced")
+    monkeypatch.setattr(repack.os, "replace", crash)
+    with pytest.raises(OSError):
+        _repack(mirror, output)
+    monkeypatch.undo()
+
+    with open(os.path.join(output, REPACKED, SHARD_INDEX_NAME)) as f:
+        assert f.read() == index
+    storage = ShardStorage(path=output, fallback=LocalStorage(root=mirror))
+    for frame in FRAMES:
+        if frame.startswith(REPACKED) and frame != key:
+            with storage.open(frame) as f:
+                assert f.read() == FRAMES[frame]
+    with storage.open(key) as f:
+        assert f.read() == FRAMES[key]
@@ -0,0 +1,398 @@
+import argparse
+import runpy
+import sys
+
+# Modules imported by each subcommand, they are only imported when the subcommand runs
+COMMAND_MODULES = {
+    "load": ["data_loaders.screenshot_loader"],
+    "validate": ["data_loaders.screenshot_loader"],
+    "export": ["data_loaders.screenshot_loader"],
+    "downsample": ["data_loaders.downsampler"],
+    "stats": ["data_loaders.dataset_statistics"],
+    "scan": ["data_loaders.frame_validation"],
+    "repack": ["data_loaders.repack"],
+    "train": ["models.distributed_training"],
+    "infer": ["models.shotscale_classifier"],
+    "evaluate": ["models.evaluation", "models.shotscale_classifier"],
+}
+
+# Subcommands which must start in a few hundred milliseconds, see midgar/import_benchmark.py
+LIGHTWEIGHT_COMMANDS = ["load", "validate", "export", "downsample", "stats", "scan", "repack"]
+
+# Subcommands which forward their arguments, unknown to this parser, to the command line of their module
+PASSTHROUGH_COMMANDS = ["train", "evaluate"]
+
+
+def _pick_split(args):
+    from data_loaders.screenshot_loader import SplitStrategy
+
+    if args.split_director:
+        return SplitStrategy.DIRECTOR
+    return SplitStrategy.RANDOM
+
+
+def _pick_metrics(args):
+    if args.metrics == "":
+        return None
+    from data_loaders.export_metrics import ExportMetrics
+
+    return ExportMetrics(interval=args.metrics_interval,
+                         output=None if args.metrics == "-" else args.metrics)
+
+
+def load(args):
+    from data_loaders.screenshot_loader import ShotScaleLoader
+
+    shotscale_loader = ShotScaleLoader()
+    shotscale_loader.obtain_datapoints(class_path=args.classes)
+
+
+def validate(args):
+    from data_loaders.screenshot_loader import ShotScaleLoader
+
+    shotscale_loader = ShotScaleLoader()
+    shotscale_loader.obtain_datapoints(class_path=args.classes)
+    valid_datapoints = shotscale_loader.obtain_valid_datapoints()
+    print("Valid datapoints : {0}/{1}".format(len(valid_datapoints),
+                                              len(shotscale_loader.datapoints)))
+
+
+def export(args):
+    from data_loaders.screenshot_loader import (ShotScaleLoader, ShotScaleLocalExporter,
+                                                ResizeAlgorithm)
+
+    picked_algo = ResizeAlgorithm.CROPPED if args.cropped_resize else ResizeAlgorithm.RESCALE
+    shotscale_loader = ShotScaleLoader()
+    streaming = args.incremental or args.stream or args.movies is not None or args.directors is not None
+    if streaming:
+        datapoints = shotscale_loader.iter_datapoints(class_path=args.classes,
+                                                      movies=args.movies,
+                                                      directors=args.directors,
+                                                      use_cache=args.use_cache)
+    else:
+        shotscale_loader.obtain_datapoints(class_path=args.classes)
+        datapoints = shotscale_loader.datapoints
+    if args.incremental:
+        from data_loaders.incremental_export import ShotScaleIncrementalExporter
+        # Only the manifest rows of the --movie / --director subset are updated
+        shotscale_exporter = ShotScaleIncrementalExporter(datapoints=datapoints,
+                                                          path=args.local_save,
+                                                          algorithm=picked_algo,
+                                                          split_strategy=_pick_split(args),
+                                                          metrics=_pick_metrics(args),
+                                                          movies=args.movies,
+                                                          directors=args.directors)
+    else:
+        shotscale_exporter = ShotScaleLocalExporter(datapoints=datapoints,
+                                                    path=args.local_save,
+                                                    algorithm=picked_algo,
+                                                    split_strategy=_pick_split(args),
+                                                    metrics=_pick_metrics(args))
+    shotscale_exporter.save(streaming=streaming)
+
+
+def downsample(args):
+    from data_loaders.downsampler import DownSampler, SplitStrategy
+
+    picked_split = SplitStrategy.DIRECTOR if args.split_director else SplitStrategy.RANDOM
+    down_sampler = DownSampler(path=args.load_from,
+                               split_strategy=picked_split,
+                               metrics=_pick_metrics(args))
+    down_sampler.save()
+
+
+def stats(args):
+    from data_loaders import dataset_statistics
+
+    labels = dataset_statistics.load_label_arrays(args.classes)
+    splits = dataset_statistics.load_export_splits(args.export) if args.export != "" else None
+    statistics = dataset_statistics.compute_statistics(labels, splits=splits)
+    if args.markdown != "":
+        dataset_statistics.update_markdown(args.markdown, statistics)
+    else:
+        print(dataset_statistics.to_markdown(statistics))
+
+
+def scan(args):
+    from data_loaders import configs
+    from data_loaders.frame_validation import validate_frames
+
+    directories = args.movies if args.movies is not None else configs.S3_INPUT_DIRECTORIES_NAMES
+    validate_frames(["{0}/".format(directory) for directory in directories], workers=args.workers)
+
+
+def repack(args):
+    from data_loaders import configs
+    from data_loaders.repack import repack as repack_movies, upload_shards
+
+    directories = args.movies if args.movies is not None else configs.S3_INPUT_DIRECTORIES_NAMES
+    repack_movies(directories, args.output, shard_size=args.shard_size_mb * 1024 * 1024,
+                  workers=args.workers)
+    if args.upload != "":
+        upload_shards(args.output, args.upload, directories)
+
+
+def train(args):
+    # Delegates to the trainer command line, which also spawns the local workers
+    sys.argv = ["models/distributed_training.py"] + args.arguments
+    runpy.run_module("models.distributed_training", run_name="__main__", alter_sys=True)
+
+
+def evaluate(args):
+    # Delegates to the evaluation command line
+    sys.argv = ["models/evaluation.py"] + args.arguments
+    runpy.run_module("models.evaluation", run_name="__main__", alter_sys=True)
+
+
+def infer(args):
+    if args.head_version is None and args.tflite == "":
+        # Without a trained model the head would be a random initialization
+        exit("Error - Give a trained model with --head_version or --tflite")
+    from models.shotscale_classifier import ShotScaleClassifier
+
+    if args.tflite != "":
+        classifier = ShotScaleClassifier.from_quantized(args.tflite, name=args.name,
+                                                        number_classes=len(args.classes))
+    else:
+        classifier = ShotScaleClassifier(name=args.name, test=False,
+                                         number_classes=len(args.classes),
+                                         head_version=args.head_version)
+
+    if args.shots:
+        labels, _ = classifier.predict_shots(args.images, batch_size=args.batch_size)
+    else:
+        labels = classifier.predict_frames(args.images, batch_size=args.batch_size)
+    for image, label in zip(args.images, labels):
+        print("{0}\t{1}".format(image, args.classes[label] if label < len(args.classes) else label))
+
+
+def _add_classes_argument(parser):
+    parser.add_argument('--classes',
+                        action="store",
+                        default="data/dataset_movie.csv",
+                        dest="classes",
+                        help="Labels csv")
+
+
+def _add_split_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--split_random',
+                       action="store_true",
+                       default=False,
+                       dest="split_random",
+                       help='Split the dataset with a random approach')
+    group.add_argument('--split_director',
+                       action="store_true",
+                       default=False,
+                       dest="split_director",
+                       help='Split the dataset with a director based split of the dataset')
+
+
+def _add_metrics_arguments(parser):
+    parser.add_argument('--metrics',
+                        action="store",
+                        default="",
+                        dest="metrics",
+                        help="Json lines file of the stage latencies, counters and ETA, - for stderr")
+    parser.add_argument('--metrics_interval',
+                        action="store",
+                        type=float,
+                        default=10,
+                        dest="metrics_interval",
+                        help="Seconds between two metrics lines")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="midgar",
+        description='ShotScale dataset and model tools')
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    subparsers.required = True
+
+    parser_load = subparsers.add_parser("load", help="Load the datapoints of the labels csv")
+    _add_classes_argument(parser_load)
+    parser_load.set_defaults(function=load)
+
+    parser_validate = subparsers.add_parser("validate", help="Check that every datapoint has a frame")
+    _add_classes_argument(parser_validate)
+    parser_validate.set_defaults(function=validate)
+
+    parser_export = subparsers.add_parser("export", help="Export the resized and split dataset")
+    _add_classes_argument(parser_export)
+    parser_export.add_argument('--local_save',
+                               action="store",
+                               required=True,
+                               dest="local_save",
+                               help="Output directory")
+    algorithm = parser_export.add_mutually_exclusive_group(required=True)
+    algorithm.add_argument('--rescale',
+                           action="store_true",
+                           default=False,
+                           dest="rescale_resize",
+                           help='Simply resize rescale the images')
+    algorithm.add_argument('--cropped',
+                           action="store_true",
+                           default=False,
+                           dest="cropped_resize",
+                           help='Crop the image to fit the tageted size')
+    _add_split_arguments(parser_export)
+    _add_metrics_arguments(parser_export)
+    parser_export.add_argument('--stream',
+                               action="store_true",
+                               default=False,
+                               dest="stream",
+                               help="Export the datapoints while reading the labels, with a stable random split")
+    parser_export.add_argument('--movie',
+                               action="append",
+                               default=None,
+                               dest="movies",
+                               help="Only export this title, can be repeated, implies --stream")
+    parser_export.add_argument('--director',
+                               action="append",
+                               default=None,
+                               dest="directors",
+                               help="Only export this director, can be repeated, implies --stream")
+    parser_export.add_argument('--use_cache',
+                               action="store_true",
+                               default=False,
+                               dest="use_cache",
+                               help="With --stream, read the labels from their npz cache, see midgar stats")
+    parser_export.add_argument('--incremental',
+                               action="store_true",
+                               default=False,
+                               dest="incremental",
+                               help="Update the previous export in place, only the changed datapoints are saved")
+    parser_export.set_defaults(function=export)
+
+    parser_downsample = subparsers.add_parser("downsample", help="Split an exported dataset again")
+    parser_downsample.add_argument('--load_from',
+                                   action="store",
+                                   required=True,
+                                   dest="load_from",
+                                   help="")
+    _add_split_arguments(parser_downsample)
+    _add_metrics_arguments(parser_downsample)
+    parser_downsample.set_defaults(function=downsample)
+
+    parser_stats = subparsers.add_parser("stats", help="Class distributions of the dataset")
+    _add_classes_argument(parser_stats)
+    parser_stats.add_argument('--export',
+                              action="store",
+                              default="",
+                              dest="export",
+                              help="Export directory used to group by split")
+    parser_stats.add_argument('--markdown',
+                              action="store",
+                              default="",
+                              dest="markdown",
+                              help="Markdown document to update, e.g. doc/inbalance.md")
+    parser_stats.set_defaults(function=stats)
+
+    parser_scan = subparsers.add_parser("scan", help="Quarantine the corrupt frames with ranged reads")
+    parser_scan.add_argument('--movie',
+                             action="append",
+                             default=None,
+                             dest="movies",
+                             help="Directory of the movie to check, can be repeated, every movie by default")
+    parser_scan.add_argument('--workers',
+                             action="store",
+                             type=int,
+                             default=16,
+                             dest="workers",
+                             help="Movies checked at the same time")
+    parser_scan.set_defaults(function=scan)
+
+    parser_repack = subparsers.add_parser("repack", help="Pack the frames of each movie into indexed shards")
+    parser_repack.add_argument('--output',
+                               action="store",
+                               required=True,
+                               dest="output",
+                               help="Local directory of the shards, then used with MIDGAR_SHARDS")
+    parser_repack.add_argument('--upload',
+                               action="store",
+                               default="",
+                               dest="upload",
+                               help="Also copy the shards to s3://<bucket>/<prefix>")
+    parser_repack.add_argument('--movie',
+                               action="append",
+                               default=None,
+                               dest="movies",
+                               help="Directory of the movie to repack, can be repeated, every movie by default")
+    parser_repack.add_argument('--shard_size_mb',
+                               action="store",
+                               type=int,
+                               default=256,
+                               dest="shard_size_mb",
+                               help="")
+    parser_repack.add_argument('--workers',
+                               action="store",
+                               type=int,
+                               default=8,
+                               dest="workers",
+                               help="Movies repacked at the same time")
+    parser_repack.set_defaults(function=repack)
+
+    parser_train = subparsers.add_parser("train", add_help=False,
+                                         help="Train the classifier, see `midgar train --help`")
+    parser_train.set_defaults(function=train)
+
+    parser_evaluate = subparsers.add_parser("evaluate", add_help=False,
+                                            help="Per class, director, movie and decade accuracy, "
+                                                 "see `midgar evaluate --help`")
+    parser_evaluate.set_defaults(function=evaluate)
+
+    parser_infer = subparsers.add_parser("infer", help="Classify images")
+    parser_infer.add_argument('images',
+                              nargs="+",
+                              help="Images, in temporal order when using --shots")
+    parser_infer.add_argument('--name',
+                              action="store",
+                              default="mobile_net",
+                              dest="name",
+                              help="Backbone of the classifier")
+    parser_infer.add_argument('--head_version',
+                              action="store",
+                              default=None,
+                              dest="head_version",
+                              help="Version of the trained head in the model registry")
+    parser_infer.add_argument('--tflite',
+                              action="store",
+                              default="",
+                              dest="tflite",
+                              help="Use a quantized .tflite model")
+    parser_infer.add_argument('--classes',
+                              action="store",
+                              type=lambda value: value.split(","),
+                              default=["close", "large", "medium", "others"],
+                              dest="classes",
+                              help="Comma separated class names, in the training order")
+    parser_infer.add_argument('--shots',
+                              action="store_true",
+                              default=False,
+                              dest="shots",
+                              help="Classify once per detected shot")
+    parser_infer.add_argument('--batch_size',
+                              action="store",
+                              type=int,
+                              default=32,
+                              dest="batch_size",
+                              help="")
+    parser_infer.set_defaults(function=infer)
+
+    return parser
+
+
+def parse_arguments(argv=None):
+    parser = build_parser()
+    (args, unknown) = parser.parse_known_args(argv)
+    if args.command in PASSTHROUGH_COMMANDS:
+        args.arguments = unknown
+    elif len(unknown) > 0:
+        parser.error("unrecognized arguments: {0}".format(" ".join(unknown)))
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    args.function(args)
+    return 0
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from midgar.cli import COMMAND_MODULES, LIGHTWEIGHT_COMMANDS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _time_command(code, repeat):
+    """Best wall time of a fresh interpreter running code, in milliseconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = 1000 * (time.perf_counter() - start)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmark(commands, repeat=3):
+    results = {"interpreter_ms": _time_command("pass", repeat),
+               "cli_ms": _time_command("import midgar.cli", repeat),
+               "commands": {}}
+    for command in commands:
+        code = "import midgar.cli\n" + "\n".join("import {0}".format(module)
+                                                 for module in COMMAND_MODULES[command])
+        try:
+            results["commands"][command] = _time_command(code, repeat)
+        except subprocess.CalledProcessError:
+            # Missing heavy dependency, e.g. tensorflow on a data only box
+            results["commands"][command] = None
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Startup time of each midgar subcommand, fails when a lightweight one is too slow')
+    parser.add_argument('--budget_ms',
+                        action="store",
+                        type=float,
+                        default=300,
+                        dest="budget_ms",
+                        help="Maximum startup time of the lightweight subcommands")
+    parser.add_argument('--repeat',
+                        action="store",
+                        type=int,
+                        default=3,
+                        dest="repeat",
+                        help="Best of this number of runs")
+    parser.add_argument('--all',
+                        action="store_true",
+                        default=False,
+                        dest="all",
+                        help="Also time the tensorflow subcommands")
+    args = parser.parse_args()
+
+    commands = list(COMMAND_MODULES) if args.all else LIGHTWEIGHT_COMMANDS
+    results = run_benchmark(commands, repeat=args.repeat)
+    print(json.dumps(results, indent=2))
+
+    too_slow = [command for command in LIGHTWEIGHT_COMMANDS
+                if command in results["commands"] and
+                (results["commands"][command] is None or results["commands"][command] > args.budget_ms)]
+    if len(too_slow) > 0:
+        exit("Error - Over the {0} ms budget : {1}".format(args.budget_ms, ", ".join(too_slow)))
@@ -0,0 +1,31 @@
+import pytest
+
+from midgar.cli import main, parse_arguments
+
+
+def test_train_forwards_its_options():
+    args = parse_arguments(["train", "--training", "x"])
+    assert args.command == "train"
+    assert args.arguments == ["--training", "x"]
+
+
+def test_train_forwards_help_and_flags():
+    args = parse_arguments(["train", "--training=x", "--fine_tune", "--local_workers", "4", "-h"])
+    assert args.arguments == ["--training=x", "--fine_tune", "--local_workers", "4", "-h"]
+
+
+def test_evaluate_forwards_its_options():
+    args = parse_arguments(["evaluate", "--split", "x", "--head_version", "1", "--saved_model", "y"])
+    assert args.command == "evaluate"
+    assert args.arguments == ["--split", "x", "--head_version", "1", "--saved_model", "y"]
+
+
+def test_unknown_options_are_rejected_elsewhere():
+    with pytest.raises(SystemExit):
+        parse_arguments(["scan", "--training", "x"])
+
+
+def test_infer_requires_a_trained_model():
+    with pytest.raises(SystemExit) as error:
+        main(["infer", "frame.jpg"])
+    assert "Error" in str(error.value)
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import socket
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def build_tf_config(workers, index):
+    return json.dumps({
+        "cluster": {"worker": workers},
+        "task": {"type": "worker", "index": index},
+    })
+
+
+def list_split(path):
+    """Files and labels of an exported split, one directory per class."""
+    classes = sorted(name for name in os.listdir(path)
+                     if os.path.isdir(os.path.join(path, name)))
+    files = []
+    labels = []
+    for label, name in enumerate(classes):
+        for filename in sorted(os.listdir(os.path.join(path, name))):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                files.append(os.path.join(path, name, filename))
+                labels.append(label)
+    return classes, files, np.array(labels, dtype=np.int64)
+
+
+def make_dataset_fn(files, labels, image_shape, number_classes, global_batch_size,
+                    normalization=None, seed=0):
+    import tensorflow as tf
+
+    def decode(path, label):
+        image = tf.io.decode_jpeg(tf.io.read_file(path), channels=3)
+        image = tf.image.resize(image, image_shape[:2]) / 255.0
+        if normalization is not None:
+            image = (image - normalization[0]) / normalization[1]
+        return image, tf.one_hot(label, number_classes)
+
+    def dataset_fn(input_context):
+        batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+        dataset = tf.data.Dataset.from_tensor_slices((files, labels))
+        # Shard on the file names so that each worker only decodes its own part
+        dataset = dataset.shard(input_context.num_input_pipelines,
+                                input_context.input_pipeline_id)
+        dataset = dataset.shuffle(min(len(files), 10000), seed=seed).repeat()
+        dataset = dataset.map(decode, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+        return dataset.batch(batch_size, drop_remainder=True).prefetch(tf.data.experimental.AUTOTUNE)
+
+    return dataset_fn
+
+
+def train_worker(args):
+    import tensorflow as tf
+
+    # The strategy must exist before any other tensorflow operation
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING))
+
+    from data_loaders.image_statistics import load_normalization
+    from models.shotscale_classifier import ShotScaleClassifier
+    from models.telemetry import TrainingTelemetry, summarize
+
+    classes, files, labels = list_split(args.training)
+    with strategy.scope():
+        # The mean/std are saved with the head and the export, prepare_frame applies them
+        classifier = ShotScaleClassifier(name=args.name, test=False,
+                                         number_classes=len(classes),
+                                         normalization=load_normalization(args.normalization)
+                                         if args.normalization != "" else None)
+        if args.fine_tune:
+            classifier.base_model.trainable = True
+            classifier.model.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate),
+                                     loss=tf.keras.losses.CategoricalCrossentropy(from_logits=True),
+                                     metrics=['acc'])
+
+    dataset = tf.keras.utils.experimental.DatasetCreator(
+        make_dataset_fn(files, labels, classifier.image_shape, len(classes),
+                        args.global_batch_size,
+                        normalization=classifier.normalization))
+    steps_per_epoch = max(1, len(files) // args.global_batch_size)
+
+    task = json.loads(os.environ.get("TF_CONFIG", "{}")).get("task", {})
+    is_chief = task.get("index", 0) == 0
+    callbacks = [
+        # Restores the model, the optimizer and the step after a restart
+        tf.keras.callbacks.BackupAndRestore(backup_dir=os.path.join(args.checkpoints, "backup"),
+                                            save_freq=args.checkpoint_steps),
+        # Every worker must save, keras only keeps the chief copy at this path
+        tf.keras.callbacks.ModelCheckpoint(os.path.join(args.checkpoints, "weights", "ckpt-{epoch:03d}"),
+                                           save_weights_only=True),
+    ]
+    if is_chief:
+        # Steps are synchronous, the chief sees the throughput of the whole cluster
+        os.makedirs(args.checkpoints, exist_ok=True)
+        telemetry = TrainingTelemetry(args.telemetry if args.telemetry != "" else
+                                      os.path.join(args.checkpoints,
+                                                   "telemetry_{0}.csv".format(int(time.time()))),
+                                      batch_size=args.global_batch_size)
+        callbacks.append(telemetry)
+
+    classifier.model.fit(dataset,
+                         epochs=args.epochs,
+                         steps_per_epoch=steps_per_epoch,
+                         callbacks=callbacks)
+
+    if is_chief:
+        summarize(telemetry.path)
+        # Heads of the registry are what infer, evaluate and the inference server load
+        version = classifier.save_head(version=args.head_version)
+        if args.fine_tune:
+            print("The backbone was fine tuned, head {0} alone does not reproduce the model, "
+                  "use the --export SavedModel".format(version))
+
+    if args.export != "":
+        # Saving runs collectives, every worker must save, only the chief copy is kept
+        export_path = args.export if is_chief else tempfile.mkdtemp(prefix="shotscale_export_")
+        classifier.save_model(export_path)
+        if not is_chief:
+            shutil.rmtree(export_path, ignore_errors=True)
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def launch_local_workers(number_workers, argv):
+    """Run the training with number_workers processes on this machine."""
+    workers = ["localhost:{0}".format(_free_port()) for _ in range(number_workers)]
+    # The workers import data_loaders and models, from the repository root
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processes = []
+    for index in range(number_workers):
+        env = dict(os.environ)
+        env["TF_CONFIG"] = build_tf_config(workers, index)
+        # CPU only nodes
+        env["CUDA_VISIBLE_DEVICES"] = ""
+        env["PYTHONPATH"] = os.pathsep.join(path for path in [root, env.get("PYTHONPATH", "")] if path != "")
+        processes.append(subprocess.Popen([sys.executable, "-m", "models.distributed_training"] + argv,
+                                          env=env))
+    return_codes = [process.wait() for process in processes]
+    if any(code != 0 for code in return_codes):
+        exit("Error - Worker(s) failed with return codes {0}".format(return_codes))
+
+
+if __name__ == "__main__":
+    # Run from the repository root: python -m models.distributed_training
+    parser = argparse.ArgumentParser(
+        description='Synchronous data-parallel training of the ShotScaleClassifier on CPU workers')
+    parser.add_argument('--training',
+                        action="store",
+                        required=True,
+                        dest="training",
+                        help="Exported training split (one directory per class)")
+    parser.add_argument('--name',
+                        action="store",
+                        default="mobile_net",
+                        dest="name",
+                        help="Backbone of the classifier")
+    parser.add_argument('--fine_tune',
+                        action="store_true",
+                        default=False,
+                        dest="fine_tune",
+                        help="Train the backbone too, not only the head")
+    parser.add_argument('--normalization',
+                        action="store",
+                        default="",
+                        dest="normalization",
+                        help="image_statistics.json of the split, standardizes the input with the "
+                             "dataset mean/std instead of only dividing by 255, saved with the model "
+                             "(--fine_tune only, the frozen backbone expects [0, 1] inputs)")
+    parser.add_argument('--learning_rate',
+                        action="store",
+                        type=float,
+                        default=1e-4,
+                        dest="learning_rate",
+                        help="Learning rate used when fine tuning")
+    parser.add_argument('--global_batch_size',
+                        action="store",
+                        type=int,
+                        default=256,
+                        dest="global_batch_size",
+                        help="Batch size summed over all the workers")
+    parser.add_argument('--epochs',
+                        action="store",
+                        type=int,
+                        default=5,
+                        dest="epochs",
+                        help="")
+    parser.add_argument('--checkpoints',
+                        action="store",
+                        default="/tmp/shotscale_checkpoints",
+                        dest="checkpoints",
+                        help="Checkpoint directory shared by the workers, training resumes from it")
+    parser.add_argument('--checkpoint_steps',
+                        action="store",
+                        type=int,
+                        default=500,
+                        dest="checkpoint_steps",
+                        help="Number of steps between two checkpoints")
+    parser.add_argument('--telemetry',
+                        action="store",
+                        default="",
+                        dest="telemetry",
+                        help="Per step csv written by the chief, "
+                             "<checkpoints>/telemetry_<timestamp>.csv by default")
+    parser.add_argument('--export',
+                        action="store",
+                        default="",
+                        dest="export",
+                        help="Path of the SavedModel exported by the chief at the end")
+    parser.add_argument('--head_version',
+                        action="store",
+                        default=None,
+                        dest="head_version",
+                        help="Version of the trained head saved in the model registry, a timestamp by default")
+    parser.add_argument('--local_workers',
+                        action="store",
+                        type=int,
+                        default=0,
+                        dest="local_workers",
+                        help="Spawn this number of worker processes on this machine, "
+                             "otherwise TF_CONFIG describes the cluster")
+    args = parser.parse_args()
+    if args.normalization != "" and not args.fine_tune:
+        exit("Error - --normalization needs --fine_tune, the pretrained backbone expects inputs in [0, 1]")
+
+    if args.local_workers > 0:
+        # The last occurrence wins, the spawned workers train instead of spawning
+        launch_local_workers(args.local_workers, sys.argv[1:] + ["--local_workers", "0"])
+    else:
+        train_worker(args)
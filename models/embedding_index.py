@@ -0,0 +1,213 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+
+class EmbeddingIndex(object):
+    """Backbone features of every datapoint, for "find shots framed like this one".
+
+    The embeddings are L2 normalized and stored as float16 (half the size of
+    float32, the cosine ranking is unchanged), the search scans the corpus by
+    chunks so the memory stays bounded even with a memory mapped index.
+    """
+    __slots__ = ("embeddings", "uuids", "directors", "titles",
+                 "years", "timestamps", "classes")
+
+    EMBEDDINGS_FILENAME = "embeddings.npy"
+    METADATA_FILENAME = "metadata.npz"
+
+    def __init__(self, embeddings, uuids, directors, titles, years, timestamps, classes):
+        self.embeddings = embeddings
+        self.uuids = uuids
+        self.directors = directors
+        self.titles = titles
+        self.years = years
+        self.timestamps = timestamps
+        self.classes = classes
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def search(self, queries, k=10, chunk_size=65536):
+        """Top k cosine neighbours of each query, returns (indexes, scores) of shape (queries, k)."""
+        queries = _normalize(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        k = min(k, len(self))
+        best_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        best_indexes = np.zeros((queries.shape[0], k), dtype=np.int64)
+        rows = np.arange(queries.shape[0])[:, np.newaxis]
+
+        for start in range(0, len(self), chunk_size):
+            chunk = np.asarray(self.embeddings[start:start + chunk_size], dtype=np.float32)
+            scores = queries @ chunk.T
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), (scores.shape[0], scores.shape[1]))
+            # Merge the chunk candidates with the best ones so far
+            candidate_scores = np.concatenate([best_scores, scores[rows, top]], axis=1)
+            candidate_indexes = np.concatenate([best_indexes, top + start], axis=1)
+            keep = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+            best_scores = candidate_scores[rows, keep]
+            best_indexes = candidate_indexes[rows, keep]
+
+        order = np.argsort(-best_scores, axis=1)
+        return best_indexes[rows, order], best_scores[rows, order]
+
+    def describe(self, index, score=None):
+        result = {
+            "uuid": str(self.uuids[index]),
+            "director": str(self.directors[index]),
+            "title": str(self.titles[index]),
+            "year": int(self.years[index]),
+            "timestamp": int(self.timestamps[index]),
+            "class": int(self.classes[index]),
+        }
+        if score is not None:
+            result["score"] = float(score)
+        return result
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self.EMBEDDINGS_FILENAME), self.embeddings)
+        np.savez(os.path.join(path, self.METADATA_FILENAME),
+                 uuids=self.uuids,
+                 directors=self.directors,
+                 titles=self.titles,
+                 years=self.years,
+                 timestamps=self.timestamps,
+                 classes=self.classes)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        embeddings = np.load(os.path.join(path, cls.EMBEDDINGS_FILENAME),
+                             mmap_mode="r" if mmap else None)
+        with np.load(os.path.join(path, cls.METADATA_FILENAME)) as metadata:
+            return cls(embeddings,
+                       metadata["uuids"],
+                       metadata["directors"],
+                       metadata["titles"],
+                       metadata["years"],
+                       metadata["timestamps"],
+                       metadata["classes"])
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed(classifier, frames, batch_size=64):
+    """Normalized backbone features of frames (paths, PIL images or uint8 arrays)."""
+    features = []
+    for start in range(0, len(frames), batch_size):
+        batch = np.stack([classifier.prepare_frame(frame)
+                          for frame in frames[start:start + batch_size]])
+        features.append(np.asarray(classifier.base_model(batch)))
+    return _normalize(np.concatenate(features).astype(np.float32))
+
+
+def build_index(classifier, datapoints, batch_size=64):
+    """Download and embed every datapoint, the ones that fail are left out."""
+    embeddings = None
+    kept = []
+    batch = []
+    frames = []
+    written = 0
+
+    def flush():
+        nonlocal embeddings, written
+        features = _normalize(np.asarray(classifier.base_model(np.stack(frames))).astype(np.float32))
+        if embeddings is None:
+            embeddings = np.zeros((len(datapoints), features.shape[1]), dtype=np.float16)
+        embeddings[written:written + len(batch)] = features
+        written += len(batch)
+        kept.extend(batch)
+        batch.clear()
+        frames.clear()
+
+    for index, datapoint in enumerate(datapoints):
+        if datapoint.download_image():
+            try:
+                # Decoded one by one, a corrupt frame only leaves itself out
+                frames.append(classifier.prepare_frame(datapoint.image_path))
+                batch.append(datapoint)
+            except OSError as error:
+                print("OS ERROR - {0} - {1}".format(datapoint.uuid, error))
+            datapoint.purge()
+        if len(batch) == batch_size:
+            flush()
+        if index % 10000 == 0:
+            print("{0} Datapoint(s) embedded".format(index))
+    if len(batch) > 0:
+        flush()
+
+    if embeddings is None:
+        exit("Error - No datapoint could be embedded")
+    return EmbeddingIndex(embeddings[:written],
+                          np.array([datapoint.uuid for datapoint in kept]),
+                          np.array([datapoint.director for datapoint in kept]),
+                          np.array([datapoint.title for datapoint in kept]),
+                          np.array([datapoint.year for datapoint in kept], dtype=np.int16),
+                          np.array([datapoint.timestamp for datapoint in kept], dtype=np.int32),
+                          np.array([datapoint.clas for datapoint in kept], dtype=np.int8))
+
+
+if __name__ == "__main__":
+    # Run from the repository root: python -m models.embedding_index
+    from models.shotscale_classifier import ShotScaleClassifier
+
+    parser = argparse.ArgumentParser(
+        description='Build the similar-shot index or query it')
+    parser.add_argument('--index',
+                        action="store",
+                        default="/tmp/shotscale_index",
+                        dest="index",
+                        help="Directory of the index")
+    parser.add_argument('--name',
+                        action="store",
+                        default="mobile_net",
+                        dest="name",
+                        help="Backbone used for the embeddings")
+    parser.add_argument('--build',
+                        action="store_true",
+                        default=False,
+                        dest="build",
+                        help="Embed every datapoint of the dataset")
+    parser.add_argument('--query',
+                        action="store",
+                        nargs="*",
+                        default=[],
+                        dest="query",
+                        help="Images to search similar shots for")
+    parser.add_argument('-k',
+                        action="store",
+                        type=int,
+                        default=10,
+                        dest="k",
+                        help="Number of results per query")
+    args = parser.parse_args()
+
+    classifier = ShotScaleClassifier(name=args.name, test=False, warm_start=True)
+    if args.build:
+        from data_loaders.screenshot_loader import ShotScaleLoader
+
+        shotscale_loader = ShotScaleLoader()
+        shotscale_loader.obtain_datapoints()
+        index = build_index(classifier, shotscale_loader.datapoints)
+        index.save(args.index)
+        print("{0} embeddings saved in {1}".format(len(index), args.index))
+
+    if len(args.query) > 0:
+        index = EmbeddingIndex.load(args.index)
+        queries = embed(classifier, args.query)
+        start_time = time.time()
+        indexes, scores = index.search(queries, k=args.k)
+        print("Search over {0} shots : {1:.1f} ms".format(len(index),
+                                                         1000 * (time.time() - start_time)))
+        for query, query_indexes, query_scores in zip(args.query, indexes, scores):
+            print(query)
+            for result_index, score in zip(query_indexes, query_scores):
+                result = index.describe(result_index, score)
+                print("    {score:.3f} {director} - {title} ({year}) at {timestamp}s".format(**result))
@@ -0,0 +1,303 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Breakdowns of the report, "all" is the whole split
+GROUPS = ["all", "director", "movie", "decade"]
+
+
+class GroupedConfusion(object):
+    """Confusion matrices (label, prediction) of every value of a grouping key.
+
+    A new matrix is added the first time a value shows up, a batch is counted
+    with a single bincount over (value, label, prediction).
+    """
+    __slots__ = ("number_classes", "codes", "counts")
+
+    def __init__(self, number_classes):
+        self.number_classes = number_classes
+        self.codes = {}
+        self.counts = np.zeros((0, number_classes, number_classes), dtype=np.int64)
+
+    def update(self, values, labels, predictions):
+        codes = np.array([self.codes.setdefault(value, len(self.codes)) for value in values],
+                         dtype=np.int64)
+        if len(self.codes) > self.counts.shape[0]:
+            self.counts = np.concatenate([
+                self.counts,
+                np.zeros((len(self.codes) - self.counts.shape[0],
+                          self.number_classes, self.number_classes), dtype=np.int64)])
+        flat = (codes * self.number_classes + np.asarray(labels)) * self.number_classes + np.asarray(predictions)
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def values(self):
+        return sorted(self.codes, key=self.codes.get)
+
+
+class Evaluation(object):
+    """Confusion matrices of one model over a split, overall and per director, movie and decade."""
+
+    def __init__(self, class_names):
+        self.class_names = list(class_names)
+        self.groups = {group: GroupedConfusion(len(self.class_names)) for group in GROUPS}
+        self.frames = 0
+        self.inference_time = 0.0
+
+    def update(self, labels, predictions, directors, movies, decades):
+        self.groups["all"].update(["all"] * len(labels), labels, predictions)
+        self.groups["director"].update(directors, labels, predictions)
+        self.groups["movie"].update(movies, labels, predictions)
+        self.groups["decade"].update(decades, labels, predictions)
+        self.frames += len(labels)
+
+    def report(self):
+        overall = self.groups["all"].counts.sum(axis=0)
+        true_positives = np.diag(overall).astype(np.float64)
+        recall = true_positives / np.maximum(overall.sum(axis=1), 1)
+        precision = true_positives / np.maximum(overall.sum(axis=0), 1)
+        f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+
+        report = {
+            "frames": self.frames,
+            "accuracy": float(true_positives.sum() / max(overall.sum(), 1)),
+            "macro_f1": float(f1.mean()),
+            "frames_per_second": self.frames / self.inference_time if self.inference_time > 0 else None,
+            "confusion": overall.tolist(),
+            "classes": {name: {"precision": float(precision[index]),
+                               "recall": float(recall[index]),
+                               "f1": float(f1[index]),
+                               "frames": int(overall[index].sum())}
+                        for index, name in enumerate(self.class_names)},
+        }
+        for group in GROUPS[1:]:
+            counts = self.groups[group].counts
+            frames = counts.sum(axis=(1, 2))
+            accuracies = np.trace(counts, axis1=1, axis2=2) / np.maximum(frames, 1)
+            report[group] = {str(value): {"accuracy": float(accuracies[code]), "frames": int(frames[code])}
+                             for code, value in enumerate(self.groups[group].values())}
+        return report
+
+
+def movie_years():
+    """(director, title) -> year, from the directories of the input bucket."""
+    from data_loaders import configs
+    from data_loaders.screenshot_loader import Datapoint
+
+    years = {directory[5:]: int(directory[:4]) for directory in configs.S3_INPUT_DIRECTORIES_NAMES}
+
+    def year(director, title):
+        return years.get(Datapoint(director=director, title=title).build_key(), 0)
+    return year
+
+
+def iter_split(path, class_names):
+    """(path, label, director, title) of every frame of an exported split, one directory per class.
+
+    Frames whose name does not give their movie (the uuid1 names of the
+    DownSampler) are skipped and counted.
+    """
+    from data_loaders.screenshot_loader import parse_exported_filename
+
+    skipped = 0
+    for label, name in enumerate(class_names):
+        class_path = os.path.join(path, name)
+        if not os.path.isdir(class_path):
+            continue
+        with os.scandir(class_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(".jpg"):
+                    parsed = parse_exported_filename(entry.name)
+                    if parsed is None:
+                        skipped += 1
+                        continue
+                    yield entry.path, label, parsed[0], parsed[1]
+    if skipped > 0:
+        print("{0} frame(s) skipped, their name has no director and title".format(skipped))
+
+
+def _batches(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def evaluate(classifiers, path, class_names=None, batch_size=256, workers=8):
+    """Stream a split through every classifier in one pass, returns name -> Evaluation.
+
+    `classifiers` maps a name to a ShotScaleClassifier (its model can be a
+    QuantizedShotScaleClassifier). Frames are decoded once per input shape and
+    normalization by a thread pool while the previous batch is predicted, only two batches are
+    in memory at a time.
+    """
+    if class_names is None:
+        class_names = sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+    year = movie_years()
+    decades = {}
+    evaluations = {name: Evaluation(class_names) for name in classifiers}
+    # One decoding per model input, shared by the classifiers with the same one
+    preparers = {}
+    for classifier in classifiers.values():
+        preparers.setdefault(_input_key(classifier), classifier.prepare_frame)
+
+    def submit(executor, batch):
+        paths = [row[0] for row in batch]
+        return batch, {key: executor.map(prepare, paths) for key, prepare in preparers.items()}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batches = _batches(iter_split(path, class_names), batch_size)
+        pending = None
+        for batch in itertools.chain(batches, [None]):
+            # Decoding of the next batch runs during the inference of this one
+            current = pending
+            pending = submit(executor, batch) if batch is not None else None
+            if current is None:
+                continue
+
+            (rows, decoded) = current
+            inputs = {key: np.stack(list(frames)) for key, frames in decoded.items()}
+            labels = np.array([row[1] for row in rows], dtype=np.int64)
+            directors = [row[2] for row in rows]
+            movies = ["{0} - {1}".format(row[2], row[3]) for row in rows]
+            batch_decades = [decades.setdefault((row[2], row[3]), year(row[2], row[3]) // 10 * 10)
+                             for row in rows]
+            for name, classifier in classifiers.items():
+                start_time = time.time()
+                logits = classifier.model.predict(inputs[_input_key(classifier)])
+                evaluations[name].inference_time += time.time() - start_time
+                evaluations[name].update(labels, np.argmax(logits, axis=-1), directors, movies,
+                                         batch_decades)
+    return evaluations
+
+
+def _input_key(classifier):
+    """(image shape, normalization) of the frames prepared for a classifier."""
+    normalization = None
+    if classifier.normalization is not None:
+        normalization = tuple(tuple(np.ravel(value).tolist()) for value in classifier.normalization)
+    return tuple(classifier.image_shape), normalization
+
+
+def to_markdown(reports, group, limit=None):
+    """Accuracy of each model per value of a group, worst values of the first model first."""
+    names = list(reports)
+    first = reports[names[0]][group]
+    values = sorted(first, key=lambda value: first[value]["accuracy"])
+    if limit is not None:
+        values = values[:limit]
+    lines = ["| {0} | frames | {1} |".format(group, " | ".join(names)),
+             "|---|---|{0}".format("---|" * len(names))]
+    for value in values:
+        lines.append("| {0} | {1} | {2} |".format(
+            value, first[value]["frames"],
+            " | ".join("{0:.2%}".format(reports[name][group][value]["accuracy"]) for name in names)))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Run from the repository root: python -m models.evaluation
+    from models.shotscale_classifier import ShotScaleClassifier
+
+    parser = argparse.ArgumentParser(
+        description='Evaluate classifiers on an exported split, per class, director, movie and decade')
+    parser.add_argument('--split',
+                        action="store",
+                        required=True,
+                        dest="split",
+                        help="Exported split (one directory per class), e.g. <export>/testing")
+    parser.add_argument('--name',
+                        action="store",
+                        default="mobile_net",
+                        dest="name",
+                        help="Backbone of the classifiers")
+    parser.add_argument('--head_version',
+                        action="append",
+                        default=None,
+                        dest="head_versions",
+                        help="Trained head of the model registry, can be repeated to compare models")
+    parser.add_argument('--tflite',
+                        action="append",
+                        default=[],
+                        dest="tflite",
+                        help="Quantized .tflite model, can be repeated")
+    parser.add_argument('--saved_model',
+                        action="append",
+                        default=[],
+                        dest="saved_models",
+                        help="SavedModel of distributed_training.py --export, can be repeated")
+    parser.add_argument('--classes',
+                        action="store",
+                        type=lambda value: value.split(","),
+                        default=None,
+                        dest="classes",
+                        help="Comma separated class names in the training order, sorted directories by default")
+    parser.add_argument('--batch_size',
+                        action="store",
+                        type=int,
+                        default=256,
+                        dest="batch_size",
+                        help="")
+    parser.add_argument('--workers',
+                        action="store",
+                        type=int,
+                        default=8,
+                        dest="workers",
+                        help="Decoding threads")
+    parser.add_argument('--limit',
+                        action="store",
+                        type=int,
+                        default=10,
+                        dest="limit",
+                        help="Worst directors and movies printed")
+    parser.add_argument('--output',
+                        action="store",
+                        default="",
+                        dest="output",
+                        help="Json report with every breakdown")
+    args = parser.parse_args()
+
+    if args.head_versions is None and len(args.tflite) == 0 and len(args.saved_models) == 0:
+        # Without a trained model the head would be a random initialization
+        exit("Error - Give at least one --head_version, --saved_model or --tflite")
+
+    class_names = args.classes if args.classes is not None else \
+        sorted(name for name in os.listdir(args.split) if os.path.isdir(os.path.join(args.split, name)))
+    classifiers = {}
+    for head_version in (args.head_versions or []):
+        classifiers["head {0}".format(head_version)] = ShotScaleClassifier(
+            name=args.name, test=False, number_classes=len(class_names), head_version=head_version)
+    for saved_model in args.saved_models:
+        classifier = ShotScaleClassifier(name=args.name, test=False, number_classes=len(class_names))
+        classifier.load_saved_model(saved_model)
+        classifiers[os.path.basename(saved_model.rstrip("/"))] = classifier
+    for tflite in args.tflite:
+        classifiers[os.path.basename(tflite)] = ShotScaleClassifier.from_quantized(
+            tflite, name=args.name, number_classes=len(class_names))
+
+    evaluations = evaluate(classifiers, args.split, class_names=class_names,
+                           batch_size=args.batch_size, workers=args.workers)
+    reports = {name: evaluation.report() for name, evaluation in evaluations.items()}
+
+    for name, report in reports.items():
+        print("{0} : accuracy {1:.2%} - macro F1 {2:.3f} - {3} frames".format(
+            name, report["accuracy"], report["macro_f1"], report["frames"]))
+        for clas, metrics in report["classes"].items():
+            print("    {0:<8} precision {1:.2%} recall {2:.2%} ({3} frames)".format(
+                clas, metrics["precision"], metrics["recall"], metrics["frames"]))
+    print()
+    print(to_markdown(reports, "decade"))
+    print()
+    print(to_markdown(reports, "director", limit=args.limit))
+    print()
+    print(to_markdown(reports, "movie", limit=args.limit))
+
+    if args.output != "":
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
@@ -0,0 +1,260 @@
+import argparse
+import collections
+import io
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import PIL.Image as Image
+
+DEFAULT_CLASSES = ["close", "large", "medium", "others"]
+
+
+class InferenceRequest(object):
+    __slots__ = ("image", "arrival", "done", "logits")
+
+    def __init__(self, image):
+        self.image = image
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.logits = None
+
+
+class DynamicBatcher(object):
+    """Group the queued images into batches under a maximum latency budget.
+
+    The batch is sent to the model as soon as it is full or when the oldest
+    queued image has waited max_latency_ms.
+    """
+
+    def __init__(self, predict, max_batch_size=32, max_latency_ms=10, history=10000):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=history)
+        self.batch_sizes = collections.deque(maxlen=history)
+        self.requests = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        request = InferenceRequest(image)
+        self.queue.put(request)
+        request.done.wait()
+        return request.logits
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies, dtype=np.float64) * 1000
+            batch_sizes = np.array(self.batch_sizes, dtype=np.float64)
+            requests = self.requests
+        metrics = {
+            "requests": requests,
+            "queue_depth": self.queue.qsize(),
+            "mean_batch_size": float(batch_sizes.mean()) if len(batch_sizes) > 0 else 0.0,
+        }
+        for percentile in (50, 90, 95, 99):
+            metrics["latency_p{0}_ms".format(percentile)] = \
+                float(np.percentile(latencies, percentile)) if len(latencies) > 0 else 0.0
+        return metrics
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = batch[0].arrival + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        batch.append(self.queue.get(timeout=timeout))
+                    else:
+                        batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                logits = self.predict(np.stack([request.image for request in batch]))
+            except Exception as error:
+                print("Error while predicting a batch - {0}".format(error))
+                logits = [None] * len(batch)
+            now = time.perf_counter()
+            with self.lock:
+                self.requests += len(batch)
+                self.batch_sizes.append(len(batch))
+                for request in batch:
+                    self.latencies.append(now - request.arrival)
+            for request, request_logits in zip(batch, logits):
+                request.logits = request_logits
+                request.done.set()
+
+
+class InferenceService(object):
+    __slots__ = ("batcher", "decoders", "image_shape", "classes", "normalization")
+
+    def __init__(self, predict, image_shape, classes=DEFAULT_CLASSES,
+                 max_batch_size=32, max_latency_ms=10, decode_workers=4, normalization=None):
+        self.batcher = DynamicBatcher(predict, max_batch_size=max_batch_size,
+                                      max_latency_ms=max_latency_ms)
+        # PIL releases the GIL while decoding and resizing
+        self.decoders = ThreadPoolExecutor(max_workers=decode_workers)
+        self.image_shape = image_shape
+        self.classes = classes
+        # Input (mean, std) of the model, same preprocessing as ShotScaleClassifier.prepare_frame
+        self.normalization = normalization
+
+    def classify(self, data):
+        image = self.decoders.submit(self._decode, data).result()
+        logits = self.batcher.submit(image)
+        if logits is None:
+            raise RuntimeError("Prediction failed")
+        logits = np.asarray(logits)
+        index = int(np.argmax(logits))
+        return {
+            "class": self.classes[index] if index < len(self.classes) else str(index),
+            "index": index,
+            "logits": logits.tolist(),
+        }
+
+    def _decode(self, data):
+        image = Image.open(io.BytesIO(data))
+        image.draft("RGB", (self.image_shape[1], self.image_shape[0]))
+        image = image.convert("RGB").resize((self.image_shape[1], self.image_shape[0]))
+        image = np.asarray(image, dtype=np.float32) / 255.0
+        if self.normalization is not None:
+            image = (image - self.normalization[0]) / self.normalization[1]
+        return image
+
+
+def make_handler(service):
+
+    class InferenceHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self.send_error(404)
+                return
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                result = service.classify(data)
+            except OSError:
+                self.send_error(400, "Can't decode image")
+                return
+            except RuntimeError as error:
+                self.send_error(500, str(error))
+                return
+            self._send_json(result)
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            self._send_json(service.batcher.metrics())
+
+        def _send_json(self, content):
+            body = json.dumps(content).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return InferenceHandler
+
+
+def _load_model(args):
+    try:
+        from models.shotscale_classifier import ShotScaleClassifier
+        from models.quantization import QuantizedShotScaleClassifier
+    except ImportError:
+        from shotscale_classifier import ShotScaleClassifier
+        from quantization import QuantizedShotScaleClassifier
+
+    if args.tflite != "":
+        model = QuantizedShotScaleClassifier(args.tflite)
+        return model.predict, model.image_shape, model.normalization
+
+    classifier = ShotScaleClassifier(name=args.name, test=False,
+                                     number_classes=len(args.classes),
+                                     head_version=args.head_version,
+                                     warm_start=True)
+    keras_model = classifier.model
+
+    def predict(batch):
+        # Calling the model skips the per call overhead of keras predict
+        return keras_model(batch, training=False).numpy()
+
+    return predict, classifier.image_shape, classifier.normalization
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Local HTTP inference service of the shot scale classifier with dynamic batching')
+    parser.add_argument('--port',
+                        action="store",
+                        type=int,
+                        default=8500,
+                        dest="port",
+                        help="")
+    parser.add_argument('--name',
+                        action="store",
+                        default="mobile_net",
+                        dest="name",
+                        help="Backbone of the classifier")
+    parser.add_argument('--head_version',
+                        action="store",
+                        default=None,
+                        dest="head_version",
+                        help="Version of the trained head in the model registry")
+    parser.add_argument('--tflite',
+                        action="store",
+                        default="",
+                        dest="tflite",
+                        help="Serve a quantized .tflite model instead")
+    parser.add_argument('--classes',
+                        action="store",
+                        type=lambda value: value.split(","),
+                        default=DEFAULT_CLASSES,
+                        dest="classes",
+                        help="Comma separated class names, in the training order")
+    parser.add_argument('--max_batch_size',
+                        action="store",
+                        type=int,
+                        default=32,
+                        dest="max_batch_size",
+                        help="1 disables the batching")
+    parser.add_argument('--max_latency_ms',
+                        action="store",
+                        type=float,
+                        default=10,
+                        dest="max_latency_ms",
+                        help="Maximum time a request waits for its batch to fill")
+    parser.add_argument('--decode_workers',
+                        action="store",
+                        type=int,
+                        default=4,
+                        dest="decode_workers",
+                        help="")
+    args = parser.parse_args()
+    if args.head_version is None and args.tflite == "":
+        # Without a trained model the head would be a random initialization
+        exit("Error - Give a trained model with --head_version or --tflite")
+
+    predict, image_shape, normalization = _load_model(args)
+    service = InferenceService(predict, image_shape,
+                               classes=args.classes,
+                               max_batch_size=args.max_batch_size,
+                               max_latency_ms=args.max_latency_ms,
+                               decode_workers=args.decode_workers,
+                               normalization=normalization)
+    server = ThreadingHTTPServer(("localhost", args.port), make_handler(service))
+    print("Serving on http://localhost:{0} - POST /predict - GET /metrics".format(args.port))
+    server.serve_forever()
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+
+def run_load(url, images, concurrency=16, duration=10):
+    """Post images to url from concurrency clients during duration seconds."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client(offset):
+        index = offset
+        while time.perf_counter() < stop:
+            request = urllib.request.Request("{0}/predict".format(url),
+                                             data=images[index % len(images)],
+                                             headers={"Content-Type": "image/jpeg"})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                latency = time.perf_counter() - start
+                with lock:
+                    latencies.append(latency)
+            except OSError:
+                with lock:
+                    errors[0] += 1
+            index += concurrency
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    report = {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": len(latencies) / elapsed,
+    }
+    for percentile in (50, 95, 99):
+        report["latency_p{0}_ms".format(percentile)] = \
+            float(np.percentile(latencies, percentile)) if len(latencies) > 0 else 0.0
+    with urllib.request.urlopen("{0}/metrics".format(url)) as response:
+        report["server"] = json.loads(response.read())
+    return report
+
+
+def _load_images(path, limit=256):
+    images = []
+    for folder, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                with open(os.path.join(folder, filename), "rb") as f:
+                    images.append(f.read())
+                if len(images) >= limit:
+                    return images
+    return images
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Measure the throughput of the inference server against a single image baseline')
+    parser.add_argument('--images',
+                        action="store",
+                        default="data/test_augmentation",
+                        dest="images",
+                        help="Directory of the images to send")
+    parser.add_argument('--url',
+                        action="store",
+                        default="http://localhost:8500",
+                        dest="url",
+                        help="Server with dynamic batching")
+    parser.add_argument('--baseline_url',
+                        action="store",
+                        default="",
+                        dest="baseline_url",
+                        help="Same server started with --max_batch_size 1")
+    parser.add_argument('--concurrency',
+                        action="store",
+                        type=int,
+                        default=16,
+                        dest="concurrency",
+                        help="Number of concurrent clients")
+    parser.add_argument('--duration',
+                        action="store",
+                        type=float,
+                        default=10,
+                        dest="duration",
+                        help="Duration of each run in seconds")
+    args = parser.parse_args()
+
+    images = _load_images(args.images)
+    if len(images) == 0:
+        exit("Error - No image found in {0}".format(args.images))
+
+    reports = [run_load(args.url, images, concurrency=args.concurrency, duration=args.duration)]
+    if args.baseline_url != "":
+        reports.append(run_load(args.baseline_url, images,
+                                concurrency=args.concurrency, duration=args.duration))
+        reports[0]["speedup"] = reports[0]["throughput"] / max(reports[1]["throughput"], 1e-9)
+    print(json.dumps(reports, indent=2))
@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+MOBILENETV2 = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/feature_vector/4"
+MOBILENETV2CLASSIFIER = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/classification/4"
+INCEPTIONV3 = "https://tfhub.dev/google/tf2-preview/inception_v3/feature_vector/4"
+IMAGENET_LABELS = "https://storage.googleapis.com/download.tensorflow.org/data/ImageNetLabels.txt"
+
+DEFAULT_REGISTRY_PATH = os.environ.get("MIDGAR_MODEL_REGISTRY",
+                                       os.path.join(os.path.expanduser("~"), ".midgar", "models"))
+
+# Input mean/std saved next to a SavedModel, and next to a .tflite as <model>.normalization.json
+NORMALIZATION_NAME = "normalization.json"
+
+# Registry name of each remote handle, the version is the last segment of the url
+BACKBONES = {
+    MOBILENETV2: "mobilenet_v2_feature_vector",
+    MOBILENETV2CLASSIFIER: "mobilenet_v2_classification",
+    INCEPTIONV3: "inception_v3_feature_vector",
+}
+
+
+class ModelRegistry(object):
+    """Local store of backbones, trained heads and label files by name and version.
+
+    Layout:
+        <root>/backbones/<name>/<version>/   SavedModel usable by hub.KerasLayer
+        <root>/heads/<name>/<version>.npz    weights of the classification head, and the
+                                             input mean/std it was trained with if any
+        <root>/files/<name>                  label files
+    """
+    __slots__ = ("root",)
+
+    def __init__(self, root=DEFAULT_REGISTRY_PATH):
+        self.root = root
+
+    def backbone_path(self, name, version):
+        return os.path.join(self.root, "backbones", name, str(version))
+
+    def has_backbone(self, name, version):
+        return os.path.isfile(os.path.join(self.backbone_path(name, version),
+                                           "saved_model.pb"))
+
+    def resolve_handle(self, handle):
+        """Local path of a known hub handle if it is registered, the handle otherwise."""
+        if handle in BACKBONES:
+            version = handle.rstrip("/").split("/")[-1]
+            if self.has_backbone(BACKBONES[handle], version):
+                return self.backbone_path(BACKBONES[handle], version)
+        return handle
+
+    def register_backbone(self, handle, name=None, version=None):
+        import tensorflow_hub as hub
+
+        if name is None:
+            name = BACKBONES[handle]
+        if version is None:
+            version = handle.rstrip("/").split("/")[-1]
+        path = self.backbone_path(name, version)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copytree(hub.resolve(handle), path)
+        print("Backbone {0} version {1} registered".format(name, version))
+        return path
+
+    def file_path(self, name):
+        return os.path.join(self.root, "files", name)
+
+    def resolve_file(self, name, origin):
+        path = self.file_path(name)
+        if os.path.isfile(path):
+            return path
+        import tensorflow as tf
+        return tf.keras.utils.get_file(name, origin)
+
+    def register_file(self, name, origin):
+        import tensorflow as tf
+
+        os.makedirs(os.path.join(self.root, "files"), exist_ok=True)
+        path = self.file_path(name)
+        shutil.copyfile(tf.keras.utils.get_file(name, origin), path)
+        return path
+
+    def head_path(self, name, version):
+        return os.path.join(self.root, "heads", name, "{0}.npz".format(version))
+
+    def head_versions(self, name):
+        directory = os.path.join(self.root, "heads", name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted((filename[:-len(".npz")] for filename in os.listdir(directory)
+                       if filename.endswith(".npz")),
+                      key=lambda version: (len(version), version))
+
+    def save_head(self, name, layer, version=None, normalization=None):
+        if version is None:
+            version = str(int(time.time()))
+        path = self.head_path(name, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        weights = layer.get_weights()
+        if normalization is not None:
+            np.savez(path, *weights, mean=normalization[0], std=normalization[1])
+        else:
+            np.savez(path, *weights)
+        print("Head {0} version {1} registered".format(name, version))
+        return version
+
+    def load_head(self, name, version=None):
+        with np.load(self._registered_head_path(name, version)) as weights:
+            count = sum(1 for key in weights.files if key.startswith("arr_"))
+            return [weights["arr_{0}".format(index)] for index in range(count)]
+
+    def load_normalization(self, name, version=None):
+        """Input (mean, std) the head was trained with, None when it was trained on [0, 1] inputs."""
+        with np.load(self._registered_head_path(name, version)) as weights:
+            if "mean" not in weights.files:
+                return None
+            return weights["mean"].astype(np.float32), weights["std"].astype(np.float32)
+
+    def _registered_head_path(self, name, version):
+        if version is None:
+            versions = self.head_versions(name)
+            if len(versions) == 0:
+                raise RuntimeError("No head registered for {0}".format(name))
+            version = versions[-1]
+        path = self.head_path(name, version)
+        if not os.path.isfile(path):
+            raise RuntimeError("Head {0} version {1} is not registered".format(name, version))
+        return path
+
+
+def normalization_path(model_path):
+    """Normalization file of a SavedModel directory or of a .tflite file."""
+    if os.path.isdir(model_path):
+        return os.path.join(model_path, NORMALIZATION_NAME)
+    return "{0}.{1}".format(os.path.splitext(model_path)[0], NORMALIZATION_NAME)
+
+
+def save_normalization(model_path, normalization):
+    if normalization is None:
+        return
+    with open(normalization_path(model_path), "w") as f:
+        json.dump({"mean": np.asarray(normalization[0]).tolist(),
+                   "std": np.asarray(normalization[1]).tolist()}, f)
+
+
+def load_normalization(model_path):
+    """(mean, std) saved with an exported model, None when there is none."""
+    path = normalization_path(model_path)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        normalization = json.load(f)
+    return (np.array(normalization["mean"], dtype=np.float32),
+            np.array(normalization["std"], dtype=np.float32))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Download the backbones and labels into the local model registry for offline use')
+    parser.add_argument('--root',
+                        action="store",
+                        default=DEFAULT_REGISTRY_PATH,
+                        dest="root",
+                        help="Root directory of the registry")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(root=args.root)
+    for handle in BACKBONES:
+        registry.register_backbone(handle)
+    registry.register_file("ImageNetLabels.txt", IMAGENET_LABELS)
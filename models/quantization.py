@@ -0,0 +1,192 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+try:
+    from models.model_registry import load_normalization, save_normalization
+except ImportError:
+    from model_registry import load_normalization, save_normalization
+
+
+def export_quantized(classifier, calibration_frames, export_path, max_calibration=200):
+    """Post-training int8 quantization of the classifier, calibrated on our own frames.
+
+    Raises ValueError without calibration frames.
+    """
+    calibration_frames = list(calibration_frames)[:max_calibration]
+    if len(calibration_frames) == 0:
+        raise ValueError("Quantization needs at least one calibration frame")
+
+    def representative_dataset():
+        for frame in calibration_frames:
+            yield [classifier.prepare_frame(frame)[np.newaxis, ...]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(classifier.model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    # uint8 input tensor and float logits. The frames are still prepared by
+    # ShotScaleClassifier.prepare_frame, QuantizedShotScaleClassifier.predict
+    # quantizes them with the input scale and zero point
+    converter.inference_input_type = tf.uint8
+    tflite_model = converter.convert()
+
+    directory = os.path.dirname(export_path)
+    if directory != "":
+        os.makedirs(directory, exist_ok=True)
+    with open(export_path, "wb") as f:
+        f.write(tflite_model)
+    # The calibration ran on standardized frames, the callers must feed the same
+    save_normalization(export_path, classifier.normalization)
+    print("Quantized model saved at {0} ({1:.1f} MB)".format(export_path,
+                                                             len(tflite_model) / 2**20))
+    return export_path
+
+
+class QuantizedShotScaleClassifier(object):
+    __slots__ = ("path", "interpreter", "image_shape",
+                 "input_details", "output_details", "batch_size", "normalization")
+
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self.interpreter = tf.lite.Interpreter(model_path=path,
+                                               num_threads=num_threads)
+        self.input_details = self.interpreter.get_input_details()[0]
+        self.output_details = self.interpreter.get_output_details()[0]
+        self.image_shape = tuple(self.input_details["shape"][1:])
+        self.batch_size = None
+        self.normalization = load_normalization(path)
+
+    def predict(self, batch):
+        """Same contract as keras predict: images prepared by ShotScaleClassifier.prepare_frame, returns logits."""
+        batch = np.asarray(batch, dtype=np.float32)
+        if self.batch_size != batch.shape[0]:
+            self.interpreter.resize_tensor_input(self.input_details["index"],
+                                                 [batch.shape[0]] + list(self.image_shape))
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch.shape[0]
+
+        scale, zero_point = self.input_details["quantization"]
+        if scale != 0:
+            info = np.iinfo(self.input_details["dtype"])
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        self.interpreter.set_tensor(self.input_details["index"],
+                                   batch.astype(self.input_details["dtype"]))
+        self.interpreter.invoke()
+
+        logits = self.interpreter.get_tensor(self.output_details["index"])
+        scale, zero_point = self.output_details["quantization"]
+        if scale != 0:
+            logits = (logits.astype(np.float32) - zero_point) * scale
+        return logits
+
+
+def compare_models(classifier, quantized, frames, labels=None, batch_size=32):
+    """Accuracy and latency of the quantized model against the float one."""
+    float_predictions = []
+    quantized_predictions = []
+    float_time = 0.0
+    quantized_time = 0.0
+    for start in range(0, len(frames), batch_size):
+        batch = np.stack([classifier.prepare_frame(frame)
+                          for frame in frames[start:start + batch_size]])
+
+        start_time = time.time()
+        float_predictions.append(np.argmax(classifier.model.predict(batch), axis=-1))
+        float_time += time.time() - start_time
+
+        start_time = time.time()
+        quantized_predictions.append(np.argmax(quantized.predict(batch), axis=-1))
+        quantized_time += time.time() - start_time
+
+    float_predictions = np.concatenate(float_predictions)
+    quantized_predictions = np.concatenate(quantized_predictions)
+
+    report = {
+        "frames": len(frames),
+        "float_latency_ms": 1000 * float_time / len(frames),
+        "quantized_latency_ms": 1000 * quantized_time / len(frames),
+        "speedup": float_time / max(quantized_time, 1e-9),
+        "agreement": float(np.mean(float_predictions == quantized_predictions)),
+    }
+    if labels is not None:
+        labels = np.asarray(labels)
+        report["float_accuracy"] = float(np.mean(float_predictions == labels))
+        report["quantized_accuracy"] = float(np.mean(quantized_predictions == labels))
+
+    for key, value in report.items():
+        print("{0} : {1}".format(key, value))
+    return report
+
+
+def _list_frames(path):
+    frames = []
+    labels = []
+    classes = sorted(name for name in os.listdir(path)
+                     if os.path.isdir(os.path.join(path, name)))
+    for label, name in enumerate(classes):
+        for filename in sorted(os.listdir(os.path.join(path, name))):
+            frames.append(os.path.join(path, name, filename))
+            labels.append(label)
+    return frames, labels
+
+
+if __name__ == "__main__":
+    try:
+        from models.shotscale_classifier import ShotScaleClassifier
+    except ImportError:
+        from shotscale_classifier import ShotScaleClassifier
+
+    parser = argparse.ArgumentParser(
+        description='Export an int8 quantized model and compare it against the float model')
+    parser.add_argument('--name',
+                        action="store",
+                        default="mobile_net",
+                        dest="name",
+                        help="Backbone of the classifier")
+    parser.add_argument('--saved_model',
+                        action="store",
+                        default="",
+                        dest="saved_model",
+                        help="Trained SavedModel to quantize")
+    parser.add_argument('--calibration',
+                        action="store",
+                        required=True,
+                        dest="calibration",
+                        help="Exported split (one directory per class) used for calibration")
+    parser.add_argument('--evaluation',
+                        action="store",
+                        default="",
+                        dest="evaluation",
+                        help="Exported split (one directory per class) used for the comparison")
+    parser.add_argument('--output',
+                        action="store",
+                        default="/tmp/saved_models/shotscale_int8.tflite",
+                        dest="output",
+                        help="Path of the .tflite artifact")
+    parser.add_argument('--threads',
+                        action="store",
+                        type=int,
+                        default=None,
+                        dest="threads",
+                        help="Number of CPU threads of the TFLite interpreter")
+    args = parser.parse_args()
+
+    classifier = ShotScaleClassifier(name=args.name, test=False)
+    if args.saved_model != "":
+        classifier.load_saved_model(args.saved_model)
+
+    calibration_frames, _ = _list_frames(args.calibration)
+    if len(calibration_frames) == 0:
+        exit("Error - No calibration frame found in {0}".format(args.calibration))
+    random_state = np.random.RandomState(0)
+    random_state.shuffle(calibration_frames)
+    quantized = classifier.export_quantized(calibration_frames,
+                                            export_path=args.output,
+                                            num_threads=args.threads)
+    if args.evaluation != "":
+        frames, labels = _list_frames(args.evaluation)
+        compare_models(classifier, quantized, frames, labels=labels)
@@ -0,0 +1,83 @@
+import enum
+
+import numpy as np
+import PIL.Image as Image
+
+
+class BoundaryMethod(enum.Enum):
+    HISTOGRAM = 0
+    PIXEL = 1
+
+
+class ShotBoundaryDetector(object):
+    """Cheap cut detector working on downscaled frames.
+
+    Consecutive frames are compared either with their colour histograms or
+    with their mean absolute pixel difference, a new shot starts as soon as
+    the distance goes above the threshold.
+    """
+    __slots__ = ("method", "threshold", "thumbnail_size",
+                 "bins", "min_shot_length")
+
+    THRESHOLDS = {
+        BoundaryMethod.HISTOGRAM: 0.35,
+        BoundaryMethod.PIXEL: 0.12,
+    }
+
+    def __init__(self,
+                 method=BoundaryMethod.HISTOGRAM,
+                 threshold=None,
+                 thumbnail_size=(64, 36),
+                 bins=16,
+                 min_shot_length=2):
+        self.method = method
+        self.threshold = threshold if threshold is not None else self.THRESHOLDS[method]
+        self.thumbnail_size = thumbnail_size
+        self.bins = bins
+        self.min_shot_length = min_shot_length
+
+    def detect(self, frames):
+        """Return the list of shots as (start, end) frame indexes, end excluded."""
+        shots = []
+        start = 0
+        previous = None
+        index = -1
+        for index, frame in enumerate(frames):
+            signature = self._signature(frame)
+            if previous is not None and index - start >= self.min_shot_length:
+                if self._distance(previous, signature) > self.threshold:
+                    shots.append((start, index))
+                    start = index
+            previous = signature
+        if index >= 0:
+            shots.append((start, index + 1))
+        return shots
+
+    def _signature(self, frame):
+        image = self._thumbnail(frame)
+        pixels = np.asarray(image, dtype=np.uint8).reshape(-1, 3)
+        if self.method == BoundaryMethod.PIXEL:
+            return pixels.astype(np.float32)
+
+        # One histogram per channel, quantized to self.bins levels
+        quantized = (pixels.astype(np.int32) * self.bins) >> 8
+        offsets = np.arange(3, dtype=np.int32) * self.bins
+        histogram = np.bincount((quantized + offsets).ravel(),
+                                minlength=3 * self.bins)
+        return histogram.astype(np.float32) / pixels.shape[0]
+
+    def _distance(self, previous, current):
+        if self.method == BoundaryMethod.PIXEL:
+            return float(np.abs(current - previous).mean()) / 255.0
+        # Each channel histogram sums to 1, normalize the L1 distance to [0, 1]
+        return float(np.abs(current - previous).sum()) / 6.0
+
+    def _thumbnail(self, frame):
+        if isinstance(frame, np.ndarray):
+            frame = Image.fromarray(frame)
+        elif not isinstance(frame, Image.Image):
+            frame = Image.open(frame)
+            # Let the JPEG decoder downscale while decoding, way cheaper than a full decode
+            frame.draft("RGB", self.thumbnail_size)
+        return frame.convert("RGB").resize(self.thumbnail_size,
+                                           resample=Image.BILINEAR)
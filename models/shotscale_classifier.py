@@ -9,32 +9,71 @@ import numpy as np
 import PIL.Image as Image
 import matplotlib.pylab as plt
 
-MOBILENETV2 = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/feature_vector/4"
-MOBILENETV2CLASSIFIER = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/classification/4"
-INCEPTIONV3 = "https://tfhub.dev/google/tf2-preview/inception_v3/feature_vector/4"
+try:
+    from models.shot_boundary import ShotBoundaryDetector
+    from models.quantization import export_quantized, QuantizedShotScaleClassifier
+    from models.model_registry import (ModelRegistry, MOBILENETV2, MOBILENETV2CLASSIFIER,
+                                       INCEPTIONV3, IMAGENET_LABELS,
+                                       load_normalization, save_normalization)
+    from models.telemetry import TrainingTelemetry, summarize
+except ImportError:
+    pass
+
+try:
+    # Trying to find module on sys.path
+    from shot_boundary import ShotBoundaryDetector
+    from quantization import export_quantized, QuantizedShotScaleClassifier
+    from model_registry import (ModelRegistry, MOBILENETV2, MOBILENETV2CLASSIFIER,
+                                INCEPTIONV3, IMAGENET_LABELS,
+                                load_normalization, save_normalization)
+    from telemetry import TrainingTelemetry, summarize
+except ModuleNotFoundError:
+    pass
 
 
 class ShotScaleClassifier:
     __slots__ = ("name", "image_shape", "base_model",
                  "number_classes", "model",
-                 "labels_path", "image_net_labels")
+                 "labels_path", "image_net_labels", "registry",
+                 "normalization")
+
+    # Built models by construction arguments, filled when warm_start is set
+    WARM_MODELS = {}
+
+    def __init__(self, name="mobile_net", test=True, number_classes=5,
+                 registry=None, head_version=None, warm_start=False, normalization=None):
+        """`normalization` is the input (mean, std) of a head trained on standardized
+        frames, read from the registry with the head by default."""
+        self.name = name
+        self.registry = registry if registry is not None else ModelRegistry()
+        self.base_model = None
+        self.number_classes = number_classes
+        self.labels_path = None
+        self.image_net_labels = None
+
+        key = (name, test, number_classes, self.registry.root, head_version)
+        if warm_start and key in ShotScaleClassifier.WARM_MODELS:
+            (self.image_shape, self.base_model, self.model,
+             self.labels_path, self.image_net_labels,
+             self.normalization) = ShotScaleClassifier.WARM_MODELS[key]
+            if normalization is not None:
+                self.normalization = normalization
+            return
 
-    def __init__(self, name="mobile_net", test=True, number_classes=5):
         if name == "mobile_net":
             self.image_shape = (224, 224, 3)
             if test:
                 # load model from hub for immediate prediction
                 self.model = tf.keras.Sequential([
-                    hub.KerasLayer(MOBILENETV2CLASSIFIER,
+                    hub.KerasLayer(self.registry.resolve_handle(MOBILENETV2CLASSIFIER),
                                    input_shape=self.image_shape)
                 ])
-                self.labels_path = tf.keras.utils.get_file('ImageNetLabels.txt',
-                                                           'https://storage.googleapis.com/download.tensorflow.org/data/ImageNetLabels.txt')
+                self.labels_path = self.registry.resolve_file('ImageNetLabels.txt',
+                                                              IMAGENET_LABELS)
                 self.image_net_labels = np.array(open(self.labels_path).read().splitlines())
             else:
-                self.base_model = hub.KerasLayer(MOBILENETV2,
+                self.base_model = hub.KerasLayer(self.registry.resolve_handle(MOBILENETV2),
                                                  input_shape=self.image_shape)
-                self.number_classes = number_classes
                 self.model = tf.keras.Sequential([
                     self.base_model,
                     layers.Dense(self.number_classes)
@@ -46,9 +85,8 @@ class ShotScaleClassifier:
                                    metrics=['acc'])
         elif name == "inception":
             self.image_shape = (299, 299, 3)
-            self.base_model = hub.KerasLayer(INCEPTIONV3,
+            self.base_model = hub.KerasLayer(self.registry.resolve_handle(INCEPTIONV3),
                                              input_shape=self.image_shape)
-            self.number_classes = number_classes
             self.model = tf.keras.Sequential([
                 self.base_model,
                 layers.Dense(self.number_classes)
@@ -59,6 +97,38 @@ class ShotScaleClassifier:
                                loss=tf.keras.losses.CategoricalCrossentropy(from_logits=True),
                                metrics=['acc'])
 
+        if head_version is not None:
+            self.model.layers[-1].set_weights(self.registry.load_head(name, head_version))
+            if normalization is None:
+                normalization = self.registry.load_normalization(name, head_version)
+        self.normalization = normalization
+
+        if warm_start:
+            # Trace once so that the first real prediction does not pay for it
+            self.model.predict(np.zeros((1,) + self.image_shape, dtype=np.float32))
+            ShotScaleClassifier.WARM_MODELS[key] = (self.image_shape, self.base_model, self.model,
+                                                    self.labels_path, self.image_net_labels,
+                                                    self.normalization)
+
+    @classmethod
+    def from_quantized(cls, path, name="mobile_net", number_classes=5, num_threads=None):
+        """Classifier running a .tflite of export_quantized, the float backbone is not built."""
+        classifier = cls.__new__(cls)
+        classifier.name = name
+        classifier.registry = None
+        classifier.base_model = None
+        classifier.number_classes = number_classes
+        classifier.labels_path = None
+        classifier.image_net_labels = None
+        classifier.model = QuantizedShotScaleClassifier(path, num_threads=num_threads)
+        classifier.image_shape = classifier.model.image_shape
+        classifier.normalization = classifier.model.normalization
+        return classifier
+
+    def save_head(self, version=None):
+        return self.registry.save_head(self.name, self.model.layers[-1], version=version,
+                                       normalization=self.normalization)
+
     def summary(self):
         self.model.summary()
 
@@ -120,25 +190,13 @@ class ShotScaleClassifier:
 
         steps_per_epoch = np.ceil(image_data.samples / image_data.batch_size)
 
-        batch_stats_callback = CollectBatchStats()
+        telemetry = TrainingTelemetry("/tmp/shotscale_telemetry_{0}.csv".format(int(time.time())),
+                                      batch_size=image_data.batch_size)
 
         history = self.model.fit_generator(image_data, epochs=2,
                                            steps_per_epoch=steps_per_epoch,
-                                           callbacks=[batch_stats_callback])
-
-        plt.figure()
-        plt.ylabel("Loss")
-        plt.xlabel("Training Steps")
-        plt.ylim([0, 2])
-        plt.plot(batch_stats_callback.batch_losses)
-        plt.show()
-
-        plt.figure()
-        plt.ylabel("Accuracy")
-        plt.xlabel("Training Steps")
-        plt.ylim([0, 1])
-        plt.plot(batch_stats_callback.batch_acc)
-        plt.show()
+                                           callbacks=[telemetry])
+        summarize(telemetry.path)
 
         class_names = sorted(image_data.class_indices.items(), key=lambda pair: pair[1])
         class_names = np.array([key.title() for key, value in class_names])
@@ -161,22 +219,122 @@ class ShotScaleClassifier:
             break
         self.model.summary()
 
-    def export(self):
-        t = time.time
-        export_path = "/tmp/saved_models/{}".format(int(t))
+    def predict_frames(self, frames, batch_size=32):
+        logits = self._predict_logits(frames, batch_size=batch_size)
+        if logits is None:
+            return np.zeros((0,), dtype=np.int64)
+        return np.argmax(logits, axis=-1)
+
+    def predict_shots(self, frames, detector=None, samples_per_shot=1,
+                      batch_size=32, compare=False):
+        """Classify each shot once and propagate the label to all of its frames.
+
+        `frames` is an ordered sequence of image paths, PIL images or uint8
+        arrays. With `compare`, every frame is also classified to report the
+        speedup and the agreement against the full per-frame inference.
+        """
+        frames = list(frames)
+        if detector is None:
+            detector = ShotBoundaryDetector()
+
+        start_time = time.time()
+        shots = detector.detect(frames)
+        detection_time = time.time() - start_time
+
+        # Pick evenly spaced frames inside each shot
+        samples = []
+        owners = []
+        for shot_index, (start, end) in enumerate(shots):
+            count = min(samples_per_shot, end - start)
+            for position in np.linspace(start, end - 1, count + 2)[1:-1]:
+                samples.append(frames[int(round(position))])
+                owners.append(shot_index)
+
+        start_time = time.time()
+        logits = self._predict_logits(samples, batch_size=batch_size)
+        inference_time = time.time() - start_time
+
+        labels = np.zeros((len(frames),), dtype=np.int64)
+        if logits is not None:
+            # Vote by summing the logits of the samples of the same shot
+            shot_logits = np.zeros((len(shots), logits.shape[-1]), dtype=np.float64)
+            np.add.at(shot_logits, np.array(owners), logits)
+            shot_labels = np.argmax(shot_logits, axis=-1)
+            for shot_index, (start, end) in enumerate(shots):
+                labels[start:end] = shot_labels[shot_index]
+
+        report = {
+            "frames": len(frames),
+            "shots": len(shots),
+            "inferences": len(samples),
+            "detection_time": detection_time,
+            "inference_time": inference_time,
+        }
+        if compare:
+            start_time = time.time()
+            full_labels = self.predict_frames(frames, batch_size=batch_size)
+            full_time = time.time() - start_time
+            report["full_inference_time"] = full_time
+            report["speedup"] = full_time / max(detection_time + inference_time, 1e-9)
+            report["agreement"] = float(np.mean(full_labels == labels)) if len(frames) > 0 else 1.0
+
+        print("{0} frames - {1} shots - {2} inferences".format(report["frames"],
+                                                              report["shots"],
+                                                              report["inferences"]))
+        if compare:
+            print("Speedup : {0:.2f}x - Agreement : {1:.2%}".format(report["speedup"],
+                                                                   report["agreement"]))
+        return labels, report
+
+    def _predict_logits(self, frames, batch_size=32):
+        logits = []
+        for start in range(0, len(frames), batch_size):
+            batch = np.stack([self.prepare_frame(frame)
+                              for frame in frames[start:start + batch_size]])
+            logits.append(self.model.predict(batch))
+        if len(logits) == 0:
+            return None
+        return np.concatenate(logits)
+
+    def prepare_frame(self, frame):
+        """Model input of a frame (path, PIL image or uint8 array): resized, scaled to [0, 1] and standardized."""
+        if isinstance(frame, np.ndarray):
+            frame = Image.fromarray(frame)
+        elif not isinstance(frame, Image.Image):
+            frame = Image.open(frame)
+        frame = frame.convert("RGB").resize((self.image_shape[1], self.image_shape[0]))
+        frame = np.asarray(frame, dtype=np.float32) / 255.0
+        if self.normalization is not None:
+            frame = (frame - self.normalization[0]) / self.normalization[1]
+        return frame
+
+    def save_model(self, export_path):
+        """SavedModel of the model, with the input normalization next to it."""
         self.model.save(export_path, save_format='tf')
-        self.model = tf.keras.models.load_model(export_path)
+        save_normalization(export_path, self.normalization)
+        return export_path
 
+    def load_saved_model(self, export_path):
+        """Use a SavedModel of save_model or of distributed_training.py --export."""
+        self.model = tf.keras.models.load_model(export_path,
+                                                custom_objects={'KerasLayer': hub.KerasLayer},
+                                                compile=False)
+        self.normalization = load_normalization(export_path)
 
-class CollectBatchStats(tf.keras.callbacks.Callback):
-    def __init__(self):
-        self.batch_losses = []
-        self.batch_acc = []
+    def export(self, export_path=None):
+        if export_path is None:
+            export_path = "/tmp/saved_models/{}".format(int(time.time()))
+        self.save_model(export_path)
+        self.model = tf.keras.models.load_model(export_path,
+                                                custom_objects={'KerasLayer': hub.KerasLayer})
+        return export_path
 
-    def on_train_batch_end(self, batch, logs=None):
-        self.batch_losses.append(logs['loss'])
-        self.batch_acc.append(logs['acc'])
-        self.model.reset_metrics()
+    def export_quantized(self, calibration_frames, export_path=None, num_threads=None):
+        """Export an int8 post-training quantized TFLite model for CPU serving."""
+        if export_path is None:
+            export_path = "/tmp/saved_models/{}.tflite".format(int(time.time()))
+        export_quantized(self, calibration_frames, export_path)
+        return QuantizedShotScaleClassifier(export_path, num_threads=num_threads)
 
 
 if __name__ == "__main__":
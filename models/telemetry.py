@@ -0,0 +1,143 @@
+import argparse
+import queue
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+class TrainingTelemetry(tf.keras.callbacks.Callback):
+    """Per-step training telemetry with a negligible cost on the training loop.
+
+    Each step is written as one row of a preallocated ring buffer, full chunks
+    of rows are handed to a background thread which appends them to a csv
+    file. loss/acc are the running epoch averages reported by keras, the
+    metrics are never reset.
+
+    keras pulls the next batch inside the step, so step_time includes the
+    wait on the input pipeline. between_steps is the time spent outside of
+    the steps, in the callbacks and the python loop of fit.
+    """
+
+    FIELDS = ("step", "epoch", "time", "step_time", "between_steps",
+              "images_per_second", "loss", "acc")
+    FORMATS = ("%d", "%d", "%.3f", "%.6g", "%.6g", "%.6g", "%.6g", "%.6g")
+
+    def __init__(self, path, batch_size, capacity=4096, flush_every=512):
+        super().__init__()
+        if flush_every > capacity:
+            raise ValueError("flush_every must not be larger than the buffer capacity")
+        self.path = path
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.buffer = np.zeros((capacity, len(self.FIELDS)), dtype=np.float64)
+        self.written = 0
+        self.flushed = 0
+        self.epoch = 0
+        self.batch_begin = None
+        self.batch_end = None
+        self.queue = queue.Queue()
+        self.writer = None
+
+    def on_train_begin(self, logs=None):
+        with open(self.path, "w") as f:
+            f.write(",".join(self.FIELDS) + "\n")
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.writer.start()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_begin = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        step_time = now - self.batch_begin
+        # Callbacks and python overhead of fit between two steps
+        between_steps = self.batch_begin - self.batch_end if self.batch_end is not None else 0.0
+        self.batch_end = now
+
+        logs = logs or {}
+        row = self.buffer[self.written % self.capacity]
+        row[0] = self.written
+        row[1] = self.epoch
+        row[2] = time.time()
+        row[3] = step_time
+        row[4] = between_steps
+        row[5] = self.batch_size / step_time if step_time > 0 else 0.0
+        row[6] = logs.get("loss", np.nan)
+        row[7] = logs.get("acc", logs.get("accuracy", np.nan))
+        self.written += 1
+
+        if self.written - self.flushed >= self.flush_every:
+            self._flush()
+
+    def on_train_end(self, logs=None):
+        self._flush()
+        self.queue.put(None)
+        self.writer.join()
+
+    def last(self, count=None):
+        """Most recent rows still in the ring buffer, oldest first."""
+        available = min(self.written, self.capacity)
+        count = available if count is None else min(count, available)
+        indexes = np.arange(self.written - count, self.written) % self.capacity
+        return self.buffer[indexes]
+
+    def _flush(self):
+        if self.written == self.flushed:
+            return
+        indexes = np.arange(self.flushed, self.written) % self.capacity
+        self.queue.put(self.buffer[indexes])
+        self.flushed = self.written
+
+    def _write(self):
+        with open(self.path, "a") as f:
+            while True:
+                rows = self.queue.get()
+                if rows is None:
+                    break
+                np.savetxt(f, rows, delimiter=",", fmt=self.FORMATS)
+                f.flush()
+
+
+def summarize(path, window=500):
+    """Print the throughput and step time of each window of steps of a telemetry file."""
+    rows = np.atleast_2d(np.loadtxt(path, delimiter=",", skiprows=1))
+    if rows.size == 0:
+        print("No step recorded")
+        return
+    columns = {field: index for index, field in enumerate(TrainingTelemetry.FIELDS)}
+    for start in range(0, rows.shape[0], window):
+        chunk = rows[start:start + window]
+        step_times = chunk[:, columns["step_time"]]
+        print("Steps {0}-{1} : {2:.1f} images/s - step p50 {3:.1f} ms - p95 {4:.1f} ms - "
+              "between steps {5:.1f} ms - loss {6:.4f} - acc {7:.4f}".format(
+                  int(chunk[0, columns["step"]]),
+                  int(chunk[-1, columns["step"]]),
+                  np.median(chunk[:, columns["images_per_second"]]),
+                  1000 * np.percentile(step_times, 50),
+                  1000 * np.percentile(step_times, 95),
+                  1000 * np.mean(chunk[:, columns["between_steps"]]),
+                  chunk[-1, columns["loss"]],
+                  chunk[-1, columns["acc"]]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Summarize a training telemetry file')
+    parser.add_argument('path',
+                        action="store",
+                        help="csv file written by TrainingTelemetry")
+    parser.add_argument('--window',
+                        action="store",
+                        type=int,
+                        default=500,
+                        dest="window",
+                        help="Number of steps per line")
+    args = parser.parse_args()
+
+    summarize(args.path, window=args.window)